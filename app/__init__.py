@@ -41,6 +41,64 @@ def create_app():
     app.config["MAIL_USERNAME"] = os.environ.get("MAIL_USERNAME")
     app.config["MAIL_PASSWORD"] = os.environ.get("MAIL_PASSWORD")
     app.config["MAIL_DEFAULT_SENDER"] = os.environ.get("MAIL_DEFAULT_SENDER")
+    app.config["MAIL_ASYNC"] = os.environ.get("MAIL_ASYNC", "True") == "True"
+    app.config["MAIL_WORKERS"] = int(os.environ.get("MAIL_WORKERS", 2))
+    app.config["MAIL_MAX_ATTEMPTS"] = int(
+        os.environ.get("MAIL_MAX_ATTEMPTS", 3)
+    )
+
+    # Payment configuration
+    app.config["PAYMENT_ASYNC_INITIATION"] = (
+        os.environ.get("PAYMENT_ASYNC_INITIATION", "True") == "True"
+    )
+    app.config["PAYMENT_WORKERS"] = int(os.environ.get("PAYMENT_WORKERS", 4))
+    app.config["PAYMENT_IDEMPOTENCY_WINDOW"] = int(
+        os.environ.get("PAYMENT_IDEMPOTENCY_WINDOW", 60)
+    )
+    app.config["PAYMENT_IPN_WORKERS"] = int(
+        os.environ.get("PAYMENT_IPN_WORKERS", 2)
+    )
+    app.config["PAYMENT_IPN_DRAIN_INTERVAL"] = int(
+        os.environ.get("PAYMENT_IPN_DRAIN_INTERVAL", 30)
+    )
+    app.config["PAYMENT_IPN_MAX_ATTEMPTS"] = int(
+        os.environ.get("PAYMENT_IPN_MAX_ATTEMPTS", 8)
+    )
+    app.config["PAYMENT_RECONCILE_INTERVAL"] = int(
+        os.environ.get("PAYMENT_RECONCILE_INTERVAL", 0)
+    )
+    app.config["PAYMENT_RECONCILE_AFTER"] = int(
+        os.environ.get("PAYMENT_RECONCILE_AFTER", 15)
+    )
+    app.config["PAYMENT_RECONCILE_WORKERS"] = int(
+        os.environ.get("PAYMENT_RECONCILE_WORKERS", 4)
+    )
+    app.config["PAYMENT_RECONCILE_RATE"] = float(
+        os.environ.get("PAYMENT_RECONCILE_RATE", 5)
+    )
+
+    # Notification configuration
+    app.config["NOTIFICATION_UNREAD_REPAIR_INTERVAL"] = int(
+        os.environ.get("NOTIFICATION_UNREAD_REPAIR_INTERVAL", 0)
+    )
+    app.config["NOTIFICATION_RETENTION_DAYS"] = int(
+        os.environ.get("NOTIFICATION_RETENTION_DAYS", 90)
+    )
+    app.config["NOTIFICATION_RETENTION_ARCHIVE"] = (
+        os.environ.get("NOTIFICATION_RETENTION_ARCHIVE", "True") == "True"
+    )
+    app.config["NOTIFICATION_RETENTION_BATCH"] = int(
+        os.environ.get("NOTIFICATION_RETENTION_BATCH", 1000)
+    )
+    app.config["NOTIFICATION_RETENTION_INTERVAL"] = int(
+        os.environ.get("NOTIFICATION_RETENTION_INTERVAL", 0)
+    )
+    app.config["NOTIFICATION_COALESCE_WINDOW"] = int(
+        os.environ.get("NOTIFICATION_COALESCE_WINDOW", 60)
+    )
+    app.config["NOTIFICATION_DIGEST_INTERVAL"] = int(
+        os.environ.get("NOTIFICATION_DIGEST_INTERVAL", 0)
+    )
 
     # File upload configuration
     app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max file size
@@ -107,6 +165,82 @@ def create_app():
     def forbidden(error):
         return render_template("403.html"), 403
 
+    # Register the Pesapal IPN URL up front so checkout only reads it
+    base_url = os.environ.get("APP_BASE_URL")
+    if (
+        base_url
+        and os.environ.get("PESAPAL_REGISTER_IPN_ON_STARTUP") == "True"
+    ):
+        from app.utils.payments import register_ipn
+
+        with app.app_context():
+            try:
+                register_ipn(base_url)
+            except Exception as e:
+                app.logger.error(f"IPN registration at startup failed: {e}")
+
+    # Retry IPNs whose first processing attempt failed (seconds, 0 = off).
+    # On in every process: Pesapal does not resend an acknowledged IPN,
+    # and concurrent drains claim disjoint entries.
+    if app.config["PAYMENT_IPN_DRAIN_INTERVAL"] > 0:
+        from app.utils.background import start_periodic
+        from app.utils.payments import drain_ipn_inbox
+
+        start_periodic(
+            app,
+            "ipn-drain",
+            app.config["PAYMENT_IPN_DRAIN_INTERVAL"],
+            drain_ipn_inbox,
+        )
+
+    # Periodic reconciliation of stale Pending payments (minutes, 0 = off)
+    if app.config["PAYMENT_RECONCILE_INTERVAL"] > 0:
+        from app.utils.background import start_periodic
+        from app.utils.payments import reconcile_from_config
+
+        start_periodic(
+            app,
+            "payment-reconcile",
+            app.config["PAYMENT_RECONCILE_INTERVAL"] * 60,
+            reconcile_from_config,
+        )
+
+    # Recompute the cached unread notification counters (minutes, 0 = off)
+    if app.config["NOTIFICATION_UNREAD_REPAIR_INTERVAL"] > 0:
+        from app.utils.background import start_periodic
+        from app.utils.notifications import repair_unread_counts
+
+        start_periodic(
+            app,
+            "notification-unread-repair",
+            app.config["NOTIFICATION_UNREAD_REPAIR_INTERVAL"] * 60,
+            repair_unread_counts,
+        )
+
+    # Apply the notification retention policy (minutes, 0 = off)
+    if app.config["NOTIFICATION_RETENTION_INTERVAL"] > 0:
+        from app.utils.background import start_periodic
+        from app.utils.notification_retention import purge_from_config
+
+        start_periodic(
+            app,
+            "notification-retention",
+            app.config["NOTIFICATION_RETENTION_INTERVAL"] * 60,
+            purge_from_config,
+        )
+
+    # Email queued notification digests (minutes, 0 = off)
+    if app.config["NOTIFICATION_DIGEST_INTERVAL"] > 0:
+        from app.utils.background import start_periodic
+        from app.utils.notification_digest import send_digests
+
+        start_periodic(
+            app,
+            "notification-digest",
+            app.config["NOTIFICATION_DIGEST_INTERVAL"] * 60,
+            send_digests,
+        )
+
     # Template context processors
     @app.context_processor
     def inject_user():
@@ -114,4 +248,13 @@ def create_app():
 
         return dict(current_user=current_user)
 
+    @app.context_processor
+    def inject_unread_notifications():
+        from flask_login import current_user
+        from app.utils.notifications import unread_badge_count
+
+        if current_user.is_authenticated:
+            return dict(unread_notifications=unread_badge_count(current_user))
+        return dict(unread_notifications=0)
+
     return app
@@ -9,9 +9,25 @@ from .membership import Membership
 from .event import Event
 from .event_registration import EventRegistration
 from .feedback import Feedback
-from .notification import Notification, UserNotification
+from .notification import (
+    Notification,
+    UserNotification,
+    NotificationAudience,
+    NotificationPreference,
+    NotificationDigestItem,
+    NotificationArchive,
+    UserNotificationArchive,
+)
 from .club_gallery import ClubGallery
-from .payment import Payment, PesapalInterimPayment
+from .payment import (
+    Payment,
+    PesapalInterimPayment,
+    PesapalIpnRegistration,
+    PaymentInitiationJob,
+    PesapalIpnInbox,
+    PaymentIdempotencyKey,
+    PaymentDailyTotal,
+)
 
 __all__ = [
     "User",
@@ -25,7 +41,17 @@ __all__ = [
     "Feedback",
     "Notification",
     "UserNotification",
+    "NotificationAudience",
+    "NotificationPreference",
+    "NotificationDigestItem",
+    "NotificationArchive",
+    "UserNotificationArchive",
     "ClubGallery",
     "Payment",
     "PesapalInterimPayment",
+    "PesapalIpnRegistration",
+    "PaymentInitiationJob",
+    "PesapalIpnInbox",
+    "PaymentIdempotencyKey",
+    "PaymentDailyTotal",
 ]
@@ -4,6 +4,9 @@ from app.extensions import db
 
 class Notification(db.Model):
     __tablename__ = 'notifications'
+    __table_args__ = (
+        db.Index('ix_notifications_sent', 'sent_on', 'notification_id'),
+    )
 
     notification_id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(255), nullable=False)
@@ -22,6 +25,11 @@ class Notification(db.Model):
         back_populates='notification',
         cascade='all, delete-orphan'
     )
+    audiences = db.relationship(
+        'NotificationAudience',
+        back_populates='notification',
+        cascade='all, delete-orphan'
+    )
 
     def __repr__(self):
         return f"<Notification {self.title}>"
@@ -29,6 +37,16 @@ class Notification(db.Model):
 
 class UserNotification(db.Model):
     __tablename__ = 'user_notifications'
+    __table_args__ = (
+        db.UniqueConstraint(
+            'user_id', 'notification_id', name='uq_user_notification'
+        ),
+        db.Index(
+            'ix_user_notifications_user_read',
+            'user_id', 'is_read', 'notification_id'
+        ),
+        db.Index('ix_user_notifications_read_at', 'is_read', 'read_at'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
@@ -53,3 +71,142 @@ class UserNotification(db.Model):
     def __repr__(self):
         status = 'Read' if self.is_read else 'Unread'
         return f"<UserNotification user_id={self.user_id} notif_id={self.notification_id} ({status})>"
+
+
+class NotificationAudience(db.Model):
+    """
+    Targets a notification at a group instead of listing every recipient.
+
+    'All' reaches every user, 'Role' every user with ``role`` and 'Club'
+    the approved members and leaders of ``club_id``. A UserNotification
+    row is only written once a recipient reads the notification.
+    """
+    __tablename__ = 'notification_audiences'
+    __table_args__ = (
+        db.Index(
+            'ix_notification_audiences_target',
+            'audience_type', 'role', 'club_id'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(
+        db.Integer,
+        db.ForeignKey('notifications.notification_id', ondelete='CASCADE'),
+        nullable=False,
+        index=True
+    )
+    audience_type = db.Column(
+        db.Enum('All', 'Role', 'Club', name='audience_type'),
+        nullable=False
+    )
+    role = db.Column(
+        db.Enum('Student', 'ClubLeader', 'Admin', name='audience_role')
+    )
+    club_id = db.Column(
+        db.Integer, db.ForeignKey('clubs.club_id', ondelete='CASCADE')
+    )
+
+    notification = db.relationship(
+        'Notification',
+        back_populates='audiences'
+    )
+
+    def __repr__(self):
+        target = self.role or self.club_id or 'everyone'
+        return f"<NotificationAudience notif_id={self.notification_id} {self.audience_type}:{target}>"
+
+
+class NotificationPreference(db.Model):
+    """
+    How a user wants one kind of notification delivered.
+
+    ``notification_type`` and ``club_id`` narrow what the row covers;
+    NULL means any. The most specific matching row wins, a club beating
+    a type. ``delivery`` is 'Email' (in-app and email, the default with
+    no row), 'InApp' (no email), 'Digest' (in-app, email batched into a
+    periodic digest) or 'Off'.
+    """
+    __tablename__ = 'notification_preferences'
+    __table_args__ = (
+        db.UniqueConstraint(
+            'user_id', 'notification_type', 'club_id',
+            name='uq_notification_preference'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.user_id', ondelete='CASCADE'),
+        nullable=False
+    )
+    notification_type = db.Column(
+        db.Enum('System', 'Club', 'Event', name='preference_type')
+    )
+    club_id = db.Column(
+        db.Integer, db.ForeignKey('clubs.club_id', ondelete='CASCADE')
+    )
+    delivery = db.Column(
+        db.Enum('Email', 'InApp', 'Digest', 'Off', name='preference_delivery'),
+        nullable=False,
+        default='Email'
+    )
+
+    def __repr__(self):
+        return f"<NotificationPreference user_id={self.user_id} {self.notification_type}/{self.club_id}: {self.delivery}>"
+
+
+class NotificationDigestItem(db.Model):
+    """A notification waiting to go out in a user's next email digest."""
+    __tablename__ = 'notification_digest_items'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.user_id', ondelete='CASCADE'),
+        nullable=False,
+        index=True
+    )
+    notification_id = db.Column(
+        db.Integer,
+        db.ForeignKey('notifications.notification_id', ondelete='CASCADE'),
+        nullable=False
+    )
+
+    def __repr__(self):
+        return f"<NotificationDigestItem user_id={self.user_id} notif_id={self.notification_id}>"
+
+
+class NotificationArchive(db.Model):
+    """A notification removed by the retention job, kept for the record."""
+    __tablename__ = 'notification_archive'
+
+    notification_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    title = db.Column(db.String(255), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    notification_type = db.Column(db.String(20), nullable=False)
+    related_id = db.Column(db.Integer)
+    sent_on = db.Column(db.DateTime, index=True)
+    archived_on = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<NotificationArchive {self.title}>"
+
+
+class UserNotificationArchive(db.Model):
+    """
+    A read receipt removed by the retention job.
+
+    Keeps only who read what and when; no foreign keys, so archived rows
+    never hold up deleting users or notifications.
+    """
+    __tablename__ = 'user_notification_archive'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    notification_id = db.Column(db.Integer, nullable=False, index=True)
+    read_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f"<UserNotificationArchive user_id={self.user_id} notif_id={self.notification_id}>"
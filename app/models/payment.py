@@ -2,6 +2,7 @@
 
 from app.extensions import db
 from datetime import datetime
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 
 
 class Payment(db.Model):
@@ -10,6 +11,20 @@ class Payment(db.Model):
     """
 
     __tablename__ = "payment"
+    # Admin ledger: newest-first keyset pages, optionally narrowed by
+    # status or by purpose + club/event
+    __table_args__ = (
+        db.Index("ix_payment_created", "dateCreated", "paymentId"),
+        db.Index(
+            "ix_payment_status_created", "status", "dateCreated", "paymentId"
+        ),
+        db.Index(
+            "ix_payment_purpose_related_created",
+            "purpose",
+            "relatedId",
+            "dateCreated",
+        ),
+    )
 
     paymentId = db.Column(db.Integer, autoincrement=True, primary_key=True)
     amount = db.Column(db.Float, nullable=False)
@@ -39,9 +54,12 @@ class Payment(db.Model):
         return f"Payment(paymentId={self.paymentId}, amount={self.amount}, purpose={self.purpose})"
 
     @classmethod
-    def create(cls, details: dict) -> "Payment":
+    def create(cls, details: dict, commit: bool = True) -> "Payment":
         """
         Create a new Payment record.
+
+        With commit=False the row is only flushed, so paymentId is set but
+        the caller controls the transaction.
         """
         payment = cls(
             amount=details.get("amount"),
@@ -55,7 +73,10 @@ class Payment(db.Model):
             studentId=details.get("studentId"),
         )
         db.session.add(payment)
-        db.session.commit()
+        db.session.flush()
+        PaymentDailyTotal.record(payment, payment.status, 1)
+        if commit:
+            db.session.commit()
         return payment
 
     def updateStatus(
@@ -63,10 +84,17 @@ class Payment(db.Model):
         status: str,
         receipt_number: str = None,
         payment_method: str = None,
+        commit: bool = True,
     ) -> "Payment":
         """
         Update payment status and related fields.
+
+        Pass commit=False to leave the commit to the caller, e.g. when
+        several rows are updated in one transaction.
         """
+        if status != self.status:
+            PaymentDailyTotal.record(self, self.status, -1)
+            PaymentDailyTotal.record(self, status, 1)
         self.status = status
         if receipt_number:
             self.receiptNumber = receipt_number
@@ -74,7 +102,8 @@ class Payment(db.Model):
             self.paymentMethod = payment_method
         if status == "Completed":
             self.paymentDate = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return self
 
     def getDetails(self) -> dict:
@@ -143,10 +172,384 @@ class PesapalInterimPayment(db.Model):
         db.session.commit()
         return interim_payment
 
-    def updateStatus(self, status: str) -> "PesapalInterimPayment":
+    def updateStatus(
+        self, status: str, commit: bool = True
+    ) -> "PesapalInterimPayment":
         """
         Update interim payment status.
         """
         self.status = status
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return self
+
+
+class PesapalIpnRegistration(db.Model):
+    """
+    Model caching the Pesapal IPN registration for each site base URL.
+    """
+
+    __tablename__ = "pesapal_ipn_registration"
+
+    ipnRegistrationId = db.Column(
+        db.Integer, autoincrement=True, primary_key=True
+    )
+    baseUrl = db.Column(db.String(255), nullable=False, unique=True)
+    ipnUrl = db.Column(db.String(255), nullable=False)
+    notificationId = db.Column(db.String(255), nullable=False)
+    dateCreated = db.Column(db.DateTime, default=datetime.utcnow)
+    lastUpdated = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    def __repr__(self) -> str:
+        return f"PesapalIpnRegistration(baseUrl={self.baseUrl}, notificationId={self.notificationId})"
+
+    @classmethod
+    def get_for(cls, base_url: str) -> "PesapalIpnRegistration":
+        """
+        Get the registration for a base URL, if any.
+        """
+        return cls.query.filter_by(baseUrl=base_url).first()
+
+    @classmethod
+    def save(
+        cls, base_url: str, ipn_url: str, notification_id: str
+    ) -> "PesapalIpnRegistration":
+        """
+        Create or replace the registration for a base URL.
+        """
+        registration = cls.get_for(base_url)
+        if registration is None:
+            registration = cls(baseUrl=base_url)
+            db.session.add(registration)
+        registration.ipnUrl = ipn_url
+        registration.notificationId = notification_id
+        db.session.commit()
+        return registration
+
+
+class PaymentInitiationJob(db.Model):
+    """
+    Model for a Pesapal order submission queued for a background worker.
+    """
+
+    __tablename__ = "payment_initiation_job"
+
+    jobId = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    paymentId = db.Column(
+        db.Integer,
+        db.ForeignKey("payment.paymentId", ondelete="CASCADE"),
+        nullable=False,
+        unique=True,
+    )
+    status = db.Column(
+        db.Enum("QUEUED", "RUNNING", "SUBMITTED", "FAILED"), default="QUEUED"
+    )
+    baseUrl = db.Column(db.String(255), nullable=False)
+    customerName = db.Column(db.String(255), nullable=False)
+    phoneNumber = db.Column(db.String(20), nullable=False)
+    emailAddress = db.Column(db.String(100))
+    description = db.Column(db.String(255), nullable=False)
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.String(255))
+    dateCreated = db.Column(db.DateTime, default=datetime.utcnow)
+    lastUpdated = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    # Relationships
+    payment = db.relationship(
+        "Payment", backref=db.backref("initiation_job", uselist=False)
+    )
+
+    def __repr__(self) -> str:
+        return f"PaymentInitiationJob(jobId={self.jobId}, paymentId={self.paymentId}, status={self.status})"
+
+    @classmethod
+    def create(
+        cls, details: dict, commit: bool = True
+    ) -> "PaymentInitiationJob":
+        """
+        Create a new queued initiation job.
+
+        With commit=False the row is only flushed, so it lands in the
+        caller's transaction.
+        """
+        job = cls(
+            paymentId=details.get("paymentId"),
+            baseUrl=details.get("baseUrl"),
+            customerName=details.get("customerName"),
+            phoneNumber=details.get("phoneNumber"),
+            emailAddress=details.get("emailAddress"),
+            description=details.get("description"),
+            status="QUEUED",
+            attempts=0,
+        )
+        db.session.add(job)
+        db.session.flush()
+        if commit:
+            db.session.commit()
+        return job
+
+    @classmethod
+    def claim(cls, job_id: int) -> "PaymentInitiationJob":
+        """
+        Atomically move a QUEUED job to RUNNING; None if already taken.
+        """
+        claimed = cls.query.filter_by(jobId=job_id, status="QUEUED").update(
+            {"status": "RUNNING", "attempts": cls.attempts + 1},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if not claimed:
+            return None
+        return cls.query.get(job_id)
+
+
+class PesapalIpnInbox(db.Model):
+    """
+    Model for IPN notifications accepted but not yet processed.
+    """
+
+    __tablename__ = "pesapal_ipn_inbox"
+    __table_args__ = (
+        db.Index("ix_ipn_inbox_status_next", "status", "nextAttemptAt"),
+    )
+
+    inboxId = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    orderTrackingId = db.Column(db.String(255), nullable=False, index=True)
+    merchantReference = db.Column(db.String(255))
+    notificationType = db.Column(db.String(50))
+    status = db.Column(
+        db.Enum("RECEIVED", "PROCESSING", "DONE", "DEAD"), default="RECEIVED"
+    )
+    attempts = db.Column(db.Integer, default=0)
+    lastError = db.Column(db.String(255))
+    nextAttemptAt = db.Column(db.DateTime, default=datetime.utcnow)
+    dateCreated = db.Column(db.DateTime, default=datetime.utcnow)
+    lastUpdated = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    def __repr__(self) -> str:
+        return f"PesapalIpnInbox(inboxId={self.inboxId}, orderTrackingId={self.orderTrackingId}, status={self.status})"
+
+    @classmethod
+    def create(cls, details: dict) -> "PesapalIpnInbox":
+        """
+        Store a received IPN notification.
+        """
+        entry = cls(
+            orderTrackingId=details.get("orderTrackingId"),
+            merchantReference=details.get("merchantReference"),
+            notificationType=details.get("notificationType"),
+            status="RECEIVED",
+            attempts=0,
+            nextAttemptAt=datetime.utcnow(),
+        )
+        db.session.add(entry)
+        db.session.commit()
+        return entry
+
+    @classmethod
+    def claim(cls, inbox_id: int) -> "PesapalIpnInbox":
+        """
+        Atomically move a RECEIVED entry to PROCESSING; None if taken.
+        """
+        claimed = cls.query.filter_by(
+            inboxId=inbox_id, status="RECEIVED"
+        ).update(
+            {"status": "PROCESSING", "attempts": cls.attempts + 1},
+            synchronize_session=False,
+        )
+        db.session.commit()
+        if not claimed:
+            return None
+        return cls.query.get(inbox_id)
+
+    @classmethod
+    def claim_due(cls, limit: int) -> list:
+        """
+        Move up to ``limit`` RECEIVED entries that are due to PROCESSING.
+
+        Rows are picked with FOR UPDATE SKIP LOCKED, so drains running in
+        several processes at once claim disjoint batches.
+        """
+        entries = (
+            cls.query.filter(
+                cls.status == "RECEIVED",
+                cls.nextAttemptAt <= datetime.utcnow(),
+            )
+            .order_by(cls.inboxId)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        for entry in entries:
+            entry.status = "PROCESSING"
+            entry.attempts = (entry.attempts or 0) + 1
+        db.session.commit()
+        return entries
+
+
+class PaymentIdempotencyKey(db.Model):
+    """
+    Model remembering the response to a payment initiation request, so a
+    repeated request with the same key gets the same answer.
+    """
+
+    __tablename__ = "payment_idempotency_key"
+    __table_args__ = (
+        db.UniqueConstraint(
+            "studentId", "idempotencyKey", name="uq_payment_idempotency_key"
+        ),
+    )
+
+    keyId = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    idempotencyKey = db.Column(db.String(128), nullable=False)
+    studentId = db.Column(
+        db.Integer,
+        db.ForeignKey("students.student_id", ondelete="CASCADE"),
+        nullable=False,
+    )
+    paymentId = db.Column(
+        db.Integer,
+        db.ForeignKey("payment.paymentId", ondelete="CASCADE"),
+        nullable=False,
+    )
+    responseStatus = db.Column(db.Integer, nullable=False)
+    responseBody = db.Column(db.Text, nullable=False)
+    dateCreated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relationships
+    payment = db.relationship("Payment")
+
+    def __repr__(self) -> str:
+        return f"PaymentIdempotencyKey(studentId={self.studentId}, idempotencyKey={self.idempotencyKey}, paymentId={self.paymentId})"
+
+    @classmethod
+    def find(cls, student_id: int, key: str) -> "PaymentIdempotencyKey":
+        """
+        Get the stored attempt for a student's key, if any.
+        """
+        return cls.query.filter_by(
+            studentId=student_id, idempotencyKey=key
+        ).first()
+
+
+class PaymentDailyTotal(db.Model):
+    """
+    Model holding payment counts and amounts per creation day, purpose,
+    related club/event and status.
+
+    Kept current by Payment.create and Payment.updateStatus, so revenue
+    reports read one row per day instead of scanning every payment.
+    """
+
+    __tablename__ = "payment_daily_totals"
+    __table_args__ = (
+        db.UniqueConstraint(
+            "day",
+            "purpose",
+            "relatedId",
+            "status",
+            name="uq_payment_daily_totals",
+        ),
+    )
+
+    totalId = db.Column(db.Integer, autoincrement=True, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    purpose = db.Column(db.Enum("Membership", "Event"), nullable=False)
+    relatedId = db.Column(db.Integer, nullable=False, default=0)
+    status = db.Column(
+        db.Enum("Pending", "Completed", "Failed"), nullable=False
+    )
+    paymentCount = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self) -> str:
+        return f"PaymentDailyTotal(day={self.day}, purpose={self.purpose}, relatedId={self.relatedId}, status={self.status}, paymentCount={self.paymentCount}, amount={self.amount})"
+
+    @classmethod
+    def record(cls, payment: Payment, status: str, sign: int) -> None:
+        """
+        Add (sign=1) or remove (sign=-1) a payment from its status bucket.
+
+        Runs as a single upsert in the caller's transaction, so concurrent
+        updates to the same bucket do not lose increments.
+        """
+        if not status:
+            return
+        key = {
+            "day": (payment.dateCreated or datetime.utcnow()).date(),
+            "purpose": payment.purpose,
+            "relatedId": payment.relatedId or 0,
+            "status": status,
+        }
+        count = sign
+        amount = sign * (payment.amount or 0)
+
+        values = dict(key, paymentCount=count, amount=amount)
+        dialect = db.session.get_bind().dialect.name
+        if dialect == "mysql":
+            stmt = mysql.insert(cls).values(**values)
+            stmt = stmt.on_duplicate_key_update(
+                paymentCount=cls.paymentCount + stmt.inserted.paymentCount,
+                amount=cls.amount + stmt.inserted.amount,
+            )
+        else:
+            # SQLite and PostgreSQL share the ON CONFLICT form
+            dialect_module = postgresql if dialect == "postgresql" else sqlite
+            stmt = dialect_module.insert(cls).values(**values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(key),
+                set_={
+                    "paymentCount": cls.paymentCount
+                    + stmt.excluded.paymentCount,
+                    "amount": cls.amount + stmt.excluded.amount,
+                },
+            )
+        db.session.execute(stmt)
+
+    @classmethod
+    def rebuild(cls, since=None) -> int:
+        """
+        Recompute the totals from the payment table, optionally only for
+        days on or after the date ``since``. Does not commit; returns rows
+        written.
+        """
+        day = db.func.date(Payment.dateCreated)
+        related_id = db.func.coalesce(Payment.relatedId, 0)
+        source = db.select(
+            day,
+            Payment.purpose,
+            related_id,
+            Payment.status,
+            db.func.count(Payment.paymentId),
+            db.func.coalesce(db.func.sum(Payment.amount), 0),
+        ).where(Payment.status.isnot(None))
+
+        stale = cls.query
+        if since is not None:
+            source = source.where(Payment.dateCreated >= since)
+            stale = stale.filter(cls.day >= since)
+        source = source.group_by(
+            day, Payment.purpose, related_id, Payment.status
+        )
+
+        stale.delete(synchronize_session=False)
+        result = db.session.execute(
+            db.insert(cls).from_select(
+                [
+                    "day",
+                    "purpose",
+                    "relatedId",
+                    "status",
+                    "paymentCount",
+                    "amount",
+                ],
+                source,
+            )
+        )
+        return result.rowcount
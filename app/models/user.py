@@ -19,6 +19,9 @@ class User(db.Model, UserMixin):
     profile_image = db.Column(db.String(255), default='default-profile.png')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_login = db.Column(db.DateTime)
+    # Unread direct notifications for the nav badge; audience ones are
+    # counted when the badge is read
+    unread_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     # Relationships
     student = db.relationship(
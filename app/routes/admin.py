@@ -2,12 +2,13 @@
 
 from flask import (
     Blueprint, render_template,
-    redirect, url_for, flash, request
+    redirect, url_for, flash, request, jsonify
 )
 from flask_login import login_required, current_user
 from app.extensions import db
 from app.models.club import Club
 from app.models.admin import Admin
+from app.utils.email_queue import email_queue
 
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
@@ -55,3 +56,9 @@ def reject_club(club_id):
     db.session.commit()
     flash(f"Club “{name}” has been rejected.", "info")
     return redirect(url_for('admin.pending_clubs'))
+
+
+@admin_bp.route('/email-queue')
+def email_queue_stats():
+    """Outgoing mail queue depth, send counts and SMTP latency."""
+    return jsonify(email_queue.stats())
@@ -29,7 +29,7 @@ from app.forms import (
     ClubGalleryForm,
     AssignLeaderForm,
 )
-from app.utils.notifications import send_notification
+from app.utils.notifications import notify_audience
 
 clubs_bp = Blueprint("clubs", __name__, url_prefix="/clubs")
 
@@ -143,10 +143,9 @@ def create_club():
         db.session.commit()
 
         # notify admins
-        admin_ids = [a.user_id for a in Admin.query.all()]
         title = "New Club Created"
         msg = f"The club '{club.name}' has been created and approved."
-        send_notification(title, msg, "Club", club.club_id, admin_ids)
+        notify_audience(title, msg, "Club", club.club_id, role="Admin")
 
         flash("Club created successfully!", "success")
         return redirect(url_for("clubs.list_clubs"))
@@ -207,11 +206,9 @@ def request_club():
         db.session.commit()
 
         # Notify all admins about the new club request
-        admin_ids = [a.user_id for a in Admin.query.all()]
-        if admin_ids:
-            title = "New Club Request"
-            msg = f"A new club '{club.name}' has been requested by {current_user.first_name} {current_user.last_name}."
-            send_notification(title, msg, "Club", club.club_id, admin_ids)
+        title = "New Club Request"
+        msg = f"A new club '{club.name}' has been requested by {current_user.first_name} {current_user.last_name}."
+        notify_audience(title, msg, "Club", club.club_id, role="Admin")
 
         flash("Your club request has been submitted for approval.", "info")
         return redirect(url_for("clubs.list_clubs"))
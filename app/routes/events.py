@@ -15,8 +15,17 @@ from werkzeug.utils import secure_filename
 
 from app.extensions import db
 from app.forms import EventForm
-from app.models import Event, Club, EventRegistration, Admin, User
-from app.utils.notifications import send_notification
+from app.models import (
+    Event,
+    Club,
+    EventRegistration,
+    Admin,
+    User,
+    Membership,
+    Student,
+)
+from app.utils.notifications import email_recipients, notify_audience
+from app.utils.notification_rollup import coalescer
 from app.utils.email import (
     send_event_registration_email,
     send_event_created_email,
@@ -128,18 +137,38 @@ def register(event_id):
                     f"registered for '{event.title}'."
                 )
 
-                # DB notification
-                send_notification(
-                    title, msg, "Event", event.event_id, [recipient.user_id]
+                # Only email the patron if they have not opted out
+                email_to = email_recipients(
+                    [(recipient.user_id, recipient.email)],
+                    "Event",
+                    event.club_id,
+                )
+
+                # DB notification; a burst of registrations reaches the
+                # patron as one rollup per window
+                sent_now = coalescer.notify(
+                    title,
+                    msg,
+                    "Event",
+                    event.event_id,
+                    recipient.user_id,
+                    rollup_title=f"{{count}} More Registrations for {event.title}",
+                    rollup_message=(
+                        f"{{count}} more students registered for "
+                        f"'{event.title}'."
+                    ),
+                    email_to=email_to or None,
+                    club_id=event.club_id,
                 )
 
                 # Email notification
-                try:
-                    send_event_registration_email(
-                        current_user, event, [recipient.email]
-                    )
-                except Exception:
-                    pass  # Silently fail if email service is not configured
+                if sent_now and email_to:
+                    try:
+                        send_event_registration_email(
+                            current_user, event, email_to
+                        )
+                    except Exception:
+                        pass  # Silently fail if email service is not configured
 
         flash("You have been registered for the event!", "success")
 
@@ -188,21 +217,36 @@ def create_event():
         db.session.add(event)
         db.session.commit()
 
-        # Notify all active club members via DB + email
+        # Notify the club via DB (one audience row) + email to active members
         club = Club.query.get(event.club_id)
         if club:
-            members = [
-                m
-                for m in club.memberships
-                if m.left_on is None and m.status == "Approved"
-            ]
-            if members:
-                user_ids = [m.student.user_id for m in members]
-                emails = [m.student.user.email for m in members]
-                title = "New Event Created"
-                msg = f"A new event '{event.title}' has been scheduled for {club.name}."
-
-                send_notification(title, msg, "Event", event.event_id, user_ids)
+            title = "New Event Created"
+            msg = f"A new event '{event.title}' has been scheduled for {club.name}."
+            notification = notify_audience(
+                title, msg, "Event", event.event_id, club_id=club.club_id
+            )
+
+            # Members who chose a digest get the event in it instead
+            members = (
+                db.session.query(User.user_id, User.email)
+                .join(Student, Student.user_id == User.user_id)
+                .join(Membership, Membership.student_id == Student.student_id)
+                .filter(
+                    Membership.club_id == club.club_id,
+                    Membership.status == "Approved",
+                    Membership.left_on.is_(None),
+                )
+                .all()
+            )
+            emails = email_recipients(
+                members,
+                "Event",
+                club.club_id,
+                notification_id=(
+                    notification.notification_id if notification else None
+                ),
+            )
+            if emails:
                 try:
                     send_event_created_email(event, emails)
                 except Exception:
@@ -17,8 +17,8 @@ from app.extensions import db
 from app.models.membership import Membership
 from app.models.club_leader import ClubLeader
 from app.models.club import Club
-from app.models.notification import Notification, UserNotification
 from app.models.student import Student
+from app.utils.notifications import email_recipients, send_notification
 from app.utils.email import (
     send_membership_request_email,
     send_membership_approved_email,
@@ -82,33 +82,30 @@ def join_club(club_id):
     leaders = ClubLeader.query.filter_by(club_id=club_id).all()
     if leaders:
         # DB notifications
-        notif = Notification(
-            title="New Membership Request",
-            message=(
+        send_notification(
+            "New Membership Request",
+            (
                 f"{current_user.student.user.first_name} "
                 f"{current_user.student.user.last_name} "
                 f"has requested to join {club.name}"
             ),
-            notification_type="Club",
-            related_id=membership.membership_id,
-            via_email=True,
+            "Club",
+            membership.membership_id,
+            [lead.user_id for lead in leaders],
+            club_id=club_id,
         )
-        db.session.add(notif)
-        db.session.flush()  # populate notif.notification_id
 
-        for lead in leaders:
-            un = UserNotification(
-                user_id=lead.user_id, notification_id=notif.notification_id
-            )
-            db.session.add(un)
-        db.session.commit()
-
-        # Email notifications
+        # Email notifications, for leaders who have not opted out
         try:
-            recipient_emails = [lead.user.email for lead in leaders]
-            send_membership_request_email(
-                current_user.student.user, club, recipient_emails
+            recipient_emails = email_recipients(
+                [(lead.user_id, lead.user.email) for lead in leaders],
+                "Club",
+                club_id,
             )
+            if recipient_emails:
+                send_membership_request_email(
+                    current_user.student.user, club, recipient_emails
+                )
         except Exception:
             pass  # Silently fail if email service is not configured
 
@@ -184,26 +181,20 @@ def approve_member(club_id, mid):
 
     # DB notification for the student
     club = Club.query.get_or_404(club_id)
-    notif = Notification(
-        title="Membership Approved",
-        message=(
-            f"Hi {m.student.user.first_name}, your membership in '{club.name}' has been approved."
-        ),
-        notification_type="Club",
-        related_id=m.membership_id,
-        via_email=False,
-    )
-    db.session.add(notif)
-    db.session.flush()
-    user_notif = UserNotification(
-        user_id=m.student.user.user_id, notification_id=notif.notification_id
+    send_notification(
+        "Membership Approved",
+        f"Hi {m.student.user.first_name}, your membership in '{club.name}' has been approved.",
+        "Club",
+        m.membership_id,
+        [m.student.user.user_id],
+        club_id=club.club_id,
     )
-    db.session.add(user_notif)
-    db.session.commit()
 
     # Email notification
     try:
-        send_membership_approved_email(m.student.user, club)
+        user = m.student.user
+        if email_recipients([(user.user_id, user.email)], "Club", club_id):
+            send_membership_approved_email(user, club)
     except Exception:
         pass  # Silently fail if email service is not configured
 
@@ -233,26 +224,20 @@ def reject_member(club_id, mid):
 
     # DB notification for the student
     club = Club.query.get_or_404(club_id)
-    notif = Notification(
-        title="Membership Rejected",
-        message=(
-            f"Hi {m.student.user.first_name}, your membership request for '{club.name}' was rejected."
-        ),
-        notification_type="Club",
-        related_id=m.membership_id,
-        via_email=False,
+    send_notification(
+        "Membership Rejected",
+        f"Hi {m.student.user.first_name}, your membership request for '{club.name}' was rejected.",
+        "Club",
+        m.membership_id,
+        [m.student.user.user_id],
+        club_id=club.club_id,
     )
-    db.session.add(notif)
-    db.session.flush()
-    user_notif = UserNotification(
-        user_id=m.student.user.user_id, notification_id=notif.notification_id
-    )
-    db.session.add(user_notif)
-    db.session.commit()
 
     # Email notification
     try:
-        send_membership_rejected_email(m.student.user, club)
+        user = m.student.user
+        if email_recipients([(user.user_id, user.email)], "Club", club_id):
+            send_membership_rejected_email(user, club)
     except Exception:
         pass  # Silently fail if email service is not configured
 
@@ -368,22 +353,15 @@ def remove_member(membership_id):
     db.session.commit()
 
     # Send notification to student
-    notif = Notification(
-        title="Club Membership Ended",
-        message=f"Your membership in {club.name} has been ended. Reason: {reason}",
-        notification_type="Club",
-        related_id=membership.membership_id,
+    send_notification(
+        "Club Membership Ended",
+        f"Your membership in {club.name} has been ended. Reason: {reason}",
+        "Club",
+        membership.membership_id,
+        [membership.student.user.user_id],
         via_email=False,
+        club_id=club.club_id,
     )
-    db.session.add(notif)
-    db.session.flush()
-
-    user_notif = UserNotification(
-        user_id=membership.student.user.user_id,
-        notification_id=notif.notification_id,
-    )
-    db.session.add(user_notif)
-    db.session.commit()
 
     flash(
         f"Removed {membership.student.user.first_name} {membership.student.user.last_name} from the club.",
@@ -496,22 +474,15 @@ def approve_membership(membership_id):
     db.session.commit()
 
     # Send notification (reuse existing notification logic)
-    notif = Notification(
-        title="Membership Approved",
-        message=f"Hi {membership.student.user.first_name}, your membership in '{club.name}' has been approved.",
-        notification_type="Club",
-        related_id=membership.membership_id,
+    send_notification(
+        "Membership Approved",
+        f"Hi {membership.student.user.first_name}, your membership in '{club.name}' has been approved.",
+        "Club",
+        membership.membership_id,
+        [membership.student.user.user_id],
         via_email=False,
+        club_id=club.club_id,
     )
-    db.session.add(notif)
-    db.session.flush()
-
-    user_notif = UserNotification(
-        user_id=membership.student.user.user_id,
-        notification_id=notif.notification_id,
-    )
-    db.session.add(user_notif)
-    db.session.commit()
 
     flash(
         f"Membership approved for {membership.student.user.first_name} {membership.student.user.last_name}.",
@@ -560,22 +531,15 @@ def reject_membership(membership_id):
     db.session.commit()
 
     # Send notification
-    notif = Notification(
-        title="Membership Request Rejected",
-        message=f"Your membership request for {club.name} was not approved. Reason: {reason}",
-        notification_type="Club",
-        related_id=membership.membership_id,
+    send_notification(
+        "Membership Request Rejected",
+        f"Your membership request for {club.name} was not approved. Reason: {reason}",
+        "Club",
+        membership.membership_id,
+        [membership.student.user.user_id],
         via_email=False,
+        club_id=club.club_id,
     )
-    db.session.add(notif)
-    db.session.flush()
-
-    user_notif = UserNotification(
-        user_id=membership.student.user.user_id,
-        notification_id=notif.notification_id,
-    )
-    db.session.add(user_notif)
-    db.session.commit()
 
     flash(
         f"Membership rejected for {membership.student.user.first_name} {membership.student.user.last_name}.",
@@ -1,38 +1,356 @@
 # File: app/routes/notifications.py
 
-from flask import Blueprint, render_template, redirect, url_for
+import json
+import time
+
+import click
+from flask import (
+    current_app,
+    Blueprint,
+    Response,
+    render_template,
+    redirect,
+    url_for,
+    flash,
+    request,
+    jsonify,
+)
 from flask_login import login_required, current_user
 from app.extensions import db
-from app.models.notification import Notification, UserNotification
+from app.models.club import Club
+from app.models.notification import NotificationPreference
+from app.utils.notifications import (
+    encode_cursor,
+    get_user_notifications,
+    load_preferences,
+    mark_notification_read,
+    mark_notifications_read,
+    notification_channels,
+    notification_payload,
+    notify_audience,
+    repair_unread_counts,
+    set_preferences,
+    shows_in_feed,
+    unread_badge_count,
+    user_club_ids,
+)
+from app.utils.notification_digest import send_digests
+from app.utils.notification_retention import purge_notifications
+from app.utils.pubsub import broker
 
 notifications_bp = Blueprint("notifications", __name__, url_prefix="/notifications")
 
+BROADCAST_ROLES = ("Student", "ClubLeader", "Admin")
+
+PREFERENCE_TYPES = ("System", "Club", "Event")
+PREFERENCE_DELIVERIES = ("Email", "InApp", "Digest", "Off")
+
+# Largest list of IDs one bulk mark-read request may name
+MARK_READ_MAX_IDS = 500
+
+# Live feed: long-poll requests and SSE streams are held at most this
+# long (seconds); streams send a comment every STREAM_KEEPALIVE seconds
+LONG_POLL_MAX_WAIT = 25
+STREAM_MAX_SECONDS = 300
+STREAM_KEEPALIVE = 15
+STREAM_RETRY_MS = 3000
+
 
 @notifications_bp.route("/")
 @login_required
 def inbox():
-    """Show all notifications for the current user."""
-    items = (
-        db.session.query(UserNotification, Notification)
-        .join(Notification, UserNotification.notification_id == Notification.notification_id)
-        .filter(UserNotification.user_id == current_user.user_id)
-        .order_by(Notification.sent_on.desc())
-        .all()
+    """Show the first page of notifications for the current user."""
+    # items is list of (Notification, is_read), direct and audience alike
+    items, next_cursor = get_user_notifications(current_user)
+    return render_template(
+        "notifications.html",
+        items=items,
+        next_cursor=next_cursor,
+        # "Mark all read" covers what was there when the page loaded
+        newest_cursor=encode_cursor(items[0][0]) if items else None,
+    )
+
+
+@notifications_bp.route("/api/inbox")
+@login_required
+def api_inbox():
+    """The page of notifications after ``cursor``, for infinite scroll."""
+    items, next_cursor = get_user_notifications(
+        current_user, cursor=request.args.get("cursor")
+    )
+    return jsonify(
+        {
+            "items": [
+                notification_payload(notif, is_read)
+                for notif, is_read in items
+            ],
+            "next_cursor": next_cursor,
+        }
+    )
+
+
+def unread_event():
+    """The current user's unread count, read fresh from the database."""
+    unread = unread_badge_count(current_user)
+    return {"event": "unread", "unread_count": unread}
+
+
+@notifications_bp.route("/stream")
+@login_required
+def stream():
+    """
+    Server-Sent Events feed of new notifications and unread counts.
+
+    Opens with the current unread count, then relays 'notification' and
+    'unread' events until STREAM_MAX_SECONDS; the browser reconnects.
+    """
+    # Subscribe before reading so a change in between is not missed
+    subscription = broker.subscribe(*notification_channels(current_user))
+    try:
+        first = unread_event()
+        preferences = load_preferences(current_user)
+    except Exception:
+        subscription.close()
+        raise
+    db.session.close()
+
+    def events():
+        yield (
+            f"retry: {STREAM_RETRY_MS}\n"
+            f"event: unread\ndata: {json.dumps(first)}\n\n"
+        )
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=STREAM_KEEPALIVE)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            if not shows_in_feed(preferences, message):
+                continue
+            yield (
+                f"event: {message['event']}\n"
+                f"data: {json.dumps(message)}\n\n"
+            )
+
+    response = Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    # items is list of (UserNotification, Notification)
-    return render_template("notifications.html", items=items)
+    # The server closes the response even if the body is never read
+    response.call_on_close(subscription.close)
+    return response
+
+
+@notifications_bp.route("/api/poll")
+@login_required
+def api_poll():
+    """
+    Long-poll fallback for the live feed.
+
+    ?wait=N&unread=K holds the request until something happens, unless
+    the unread count already differs from K. Returns one event.
+    """
+    wait = min(request.args.get("wait", 0, type=float), LONG_POLL_MAX_WAIT)
+    known = request.args.get("unread", type=int)
+    channels = notification_channels(current_user)
+
+    with broker.subscribe(*channels) as subscription:
+        current = unread_event()
+        if wait <= 0 or known != current["unread_count"]:
+            return jsonify(current)
+        preferences = load_preferences(current_user)
+
+        # Give the connection back to the pool while waiting
+        db.session.close()
+        deadline = time.monotonic() + wait
+        while time.monotonic() < deadline:
+            remaining = max(deadline - time.monotonic(), 0)
+            message = subscription.get(timeout=remaining)
+            if message is None:
+                break
+            if shows_in_feed(preferences, message):
+                return jsonify(message)
+        return jsonify(current)
 
 
 @notifications_bp.route("/read/<int:notification_id>")
 @login_required
 def mark_read(notification_id):
     """Mark a specific notification as read."""
-    un = UserNotification.query.filter_by(
-        user_id=current_user.user_id,
-        notification_id=notification_id
-    ).first()
-    if un and not un.is_read:
-        un.is_read = True
-        un.read_at = db.func.now()
-        db.session.commit()
+    mark_notification_read(current_user, notification_id)
     return redirect(url_for("notifications.inbox"))
+
+
+@notifications_bp.route("/read", methods=["POST"])
+@login_required
+def mark_read_bulk():
+    """
+    Mark several notifications read in one request.
+
+    Takes either ``ids`` (a list of notification IDs) or ``before`` (a
+    cursor; everything at or older than it), as JSON or form data.
+    """
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Expected a JSON object"}), 400
+        ids, before = data.get("ids"), data.get("before")
+    else:
+        ids = request.form.getlist("ids") or None
+        before = request.form.get("before")
+
+    if ids is not None:
+        try:
+            ids = [int(i) for i in ids]
+        except (TypeError, ValueError):
+            return jsonify({"error": "ids must be a list of integers"}), 400
+        if len(ids) > MARK_READ_MAX_IDS:
+            return (
+                jsonify({"error": f"At most {MARK_READ_MAX_IDS} ids per call"}),
+                400,
+            )
+        marked = mark_notifications_read(current_user, notification_ids=ids)
+    elif before:
+        marked = mark_notifications_read(current_user, before=before)
+    else:
+        return jsonify({"error": "Send ids or before"}), 400
+
+    if not request.is_json:
+        return redirect(url_for("notifications.inbox"))
+    return jsonify(
+        {"marked": marked, "unread_count": unread_badge_count(current_user)}
+    )
+
+
+@notifications_bp.route("/broadcast", methods=["GET", "POST"])
+@login_required
+def broadcast():
+    """Let admins notify everyone, one role or one club in a single write."""
+    if current_user.role != "Admin":
+        flash("Only administrators can broadcast notifications.", "danger")
+        return redirect(url_for("notifications.inbox"))
+
+    clubs = Club.query.order_by(Club.name).all()
+    if request.method == "POST":
+        title = request.form.get("title", "").strip()
+        message = request.form.get("message", "").strip()
+        audience = request.form.get("audience", "All")
+        role = request.form.get("role")
+        club_id = request.form.get("club_id", type=int)
+
+        if not title or not message:
+            flash("A title and a message are required.", "warning")
+        elif audience == "Role" and role not in BROADCAST_ROLES:
+            flash("Choose which role to notify.", "warning")
+        elif audience == "Club" and not club_id:
+            flash("Choose which club to notify.", "warning")
+        else:
+            notification = notify_audience(
+                title,
+                message,
+                "Club" if audience == "Club" else "System",
+                related_id=club_id if audience == "Club" else None,
+                club_id=club_id if audience == "Club" else None,
+                role=role if audience == "Role" else None,
+            )
+            if notification:
+                flash("Notification sent.", "success")
+                return redirect(url_for("notifications.broadcast"))
+            flash("The notification could not be sent.", "danger")
+
+    return render_template(
+        "notifications_broadcast.html", clubs=clubs, roles=BROADCAST_ROLES
+    )
+
+
+@notifications_bp.route("/preferences", methods=["GET", "POST"])
+@login_required
+def preferences():
+    """Choose how each kind of notification, and each club's, arrives."""
+    clubs = (
+        Club.query.filter(
+            Club.club_id.in_(user_club_ids(current_user))
+        )
+        .order_by(Club.name)
+        .all()
+    )
+
+    current = {
+        (pref.notification_type, pref.club_id): pref.delivery
+        for pref in NotificationPreference.query.filter_by(
+            user_id=current_user.user_id
+        )
+    }
+
+    if request.method == "POST":
+        # Keep rows the form has no field for (one type within one
+        # club, or everything at once)
+        chosen = {
+            (notification_type, club_id): delivery
+            for (notification_type, club_id), delivery in current.items()
+            if (notification_type is None) == (club_id is None)
+        }
+        for notification_type in PREFERENCE_TYPES:
+            delivery = request.form.get(f"type_{notification_type}")
+            if delivery in PREFERENCE_DELIVERIES and delivery != "Email":
+                chosen[(notification_type, None)] = delivery
+        # A blank club choice follows the per-type settings
+        for club in clubs:
+            delivery = request.form.get(f"club_{club.club_id}")
+            if delivery in PREFERENCE_DELIVERIES:
+                chosen[(None, club.club_id)] = delivery
+        set_preferences(current_user, chosen)
+        flash("Notification preferences saved.", "success")
+        return redirect(url_for("notifications.preferences"))
+
+    return render_template(
+        "notification_preferences.html",
+        clubs=clubs,
+        current=current,
+        types=PREFERENCE_TYPES,
+    )
+
+
+@notifications_bp.cli.command("repair-unread")
+@click.option("--user-id", type=int, multiple=True, help="Only these users.")
+def repair_unread_command(user_id):
+    """Recompute the cached unread notification counters."""
+    changed = repair_unread_counts(list(user_id) or None)
+    click.echo(f"Unread counters corrected for {changed} users")
+
+
+@notifications_bp.cli.command("purge")
+@click.option(
+    "--days",
+    type=int,
+    default=lambda: current_app.config["NOTIFICATION_RETENTION_DAYS"],
+    help="Remove notifications read or sent more than this many days ago.",
+)
+@click.option(
+    "--archive/--delete",
+    default=lambda: current_app.config["NOTIFICATION_RETENTION_ARCHIVE"],
+    help="Copy rows to the archive tables, or delete them outright.",
+)
+@click.option(
+    "--batch-size",
+    type=int,
+    default=lambda: current_app.config["NOTIFICATION_RETENTION_BATCH"],
+)
+def purge_command(days, archive, batch_size):
+    """Apply the notification retention policy now."""
+    if days < 1:
+        raise click.BadParameter("must be at least 1", param_hint="--days")
+    summary = purge_notifications(days, archive, batch_size)
+
+    action = "archived" if archive else "deleted"
+    click.echo(f"Notification retention summary ({action})")
+    for key, value in summary.items():
+        click.echo(f"  {key.replace('_', ' '):<24} {value}")
+
+
+@notifications_bp.cli.command("send-digests")
+def send_digests_command():
+    """Email queued notification digests now."""
+    sent = send_digests()
+    click.echo(f"Notification digests sent: {sent}")
@@ -9,23 +9,76 @@ from flask import (
     request,
     jsonify,
     current_app,
+    abort,
+    Response,
+    send_file,
+    stream_with_context,
 )
 from flask_login import login_required, current_user
 from functools import wraps
-from datetime import datetime
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+import os
+import json
+import time
+import tempfile
+import click
 
 from app.extensions import db
 from app.models import (
     Payment,
     PesapalInterimPayment,
+    PaymentInitiationJob,
+    PesapalIpnInbox,
+    PaymentIdempotencyKey,
+    PaymentDailyTotal,
     Membership,
     Club,
     Event,
 )
 from app.utils import pesapal
+from app.utils import payment_ledger
+from app.utils.pubsub import broker
+from app.utils.payments import (
+    accept_ipn,
+    GATEWAY_BUSY_MESSAGE,
+    derive_idempotency_key,
+    drain_ipn_inbox,
+    get_receipt,
+    payment_channel,
+    payment_status_payload,
+    publish_payment_status,
+    process_transaction_update,
+    queue_initiation,
+    start_initiation,
+    reconcile_pending,
+    register_ipn,
+)
 
 payments_bp = Blueprint("payments", __name__, url_prefix="/payments")
 
+# Live status: long-poll requests and SSE streams are held at most this
+# long (seconds); streams send a comment every STREAM_KEEPALIVE seconds
+LONG_POLL_MAX_WAIT = 25
+STREAM_MAX_SECONDS = 300
+STREAM_KEEPALIVE = 15
+STREAM_RETRY_MS = 3000
+
+
+def gateway_busy_response():
+    """Fail fast with 503 while the Pesapal circuit breaker is open."""
+    retry_after = max(pesapal.breaker.retry_after(), 1)
+    response = jsonify(
+        {
+            "success": False,
+            "error": GATEWAY_BUSY_MESSAGE,
+            "retry_after": retry_after,
+        }
+    )
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
 
 def student_required(f):
     """Decorator to ensure the current_user is a Student with a valid student record."""
@@ -62,6 +115,14 @@ def admin_required(f):
     return decorated_view
 
 
+def idempotent_replay(stored):
+    """Return the response recorded for an earlier identical request."""
+    response = jsonify(json.loads(stored.responseBody))
+    response.status_code = stored.responseStatus
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
 # === PAYMENT INITIATION ROUTES ===
 
 
@@ -135,91 +196,127 @@ def initiate_payment():
         else:
             return jsonify({"success": False, "error": "Invalid purpose"}), 400
 
-        # Create payment record
+        # Repeats of the same checkout (double clicks, mobile retries)
+        # get the first attempt's response instead of a new order
+        student_id = current_user.student.student_id
+        header_key = request.headers.get("Idempotency-Key")
+        if header_key is not None and not 0 < len(header_key) <= 128:
+            return (
+                jsonify({"success": False, "error": "Invalid Idempotency-Key"}),
+                400,
+            )
+        idempotency_key = header_key or derive_idempotency_key(
+            purpose, related_id, amount
+        )
+
+        stored = PaymentIdempotencyKey.find(student_id, idempotency_key)
+        if stored:
+            window = timedelta(
+                seconds=current_app.config.get("PAYMENT_IDEMPOTENCY_WINDOW", 60)
+            )
+            if header_key or (
+                stored.payment.status != "Failed"
+                and stored.dateCreated > datetime.utcnow() - window
+            ):
+                return idempotent_replay(stored)
+            # A derived key only merges repeats within the window of the
+            # first attempt, and must not block a retry after a failure.
+            # A concurrent retry may have removed it already.
+            PaymentIdempotencyKey.query.filter_by(keyId=stored.keyId).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+
+        # Don't create a payment we already know Pesapal can't take
+        if pesapal.breaker.is_open():
+            return gateway_busy_response()
+
+        # Create payment record and its idempotency key together
         payment = Payment.create(
             {
-                "studentId": current_user.student.student_id,
+                "studentId": student_id,
                 "amount": amount,
                 "purpose": purpose,
                 "relatedId": related_id,
                 "status": "Pending",
-            }
+            },
+            commit=False,
         )
+        response_body = {
+            "success": True,
+            "payment_id": payment.paymentId,
+            "status_url": url_for(
+                "payments.api_payment_status",
+                payment_id=payment.paymentId,
+            ),
+            "message": "Payment initiated successfully",
+        }
+        db.session.add(
+            PaymentIdempotencyKey(
+                idempotencyKey=idempotency_key,
+                studentId=student_id,
+                paymentId=payment.paymentId,
+                responseStatus=202,
+                responseBody=json.dumps(response_body),
+            )
+        )
+        try:
+            # The job commits with the payment and key, so a stored key
+            # always has a job behind it
+            job = queue_initiation(
+                payment,
+                {
+                    "base_url": f"{request.scheme}://{request.host}",
+                    "customer_name": customer_name,
+                    "phone_number": phone_number,
+                    "email_address": current_user.email,
+                    "description": description,
+                },
+            )
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent duplicate got there first; answer as it did
+            db.session.rollback()
+            stored = PaymentIdempotencyKey.find(student_id, idempotency_key)
+            if stored is None:
+                # ...and has since been rolled back or replaced
+                return (
+                    jsonify(
+                        {
+                            "success": False,
+                            "error": "This checkout is already being "
+                            "processed. Please try again.",
+                        }
+                    ),
+                    409,
+                )
+            return idempotent_replay(stored)
 
         current_app.logger.info(
             f"💰 Created payment with ID: {payment.paymentId}"
         )
 
-        # Get base URL for callbacks
-        base_url = f"{request.scheme}://{request.host}"
-
-        # Get Pesapal access token
-        token_response = pesapal.get_access_token()
-        access_token = token_response["token"]
-
-        if not access_token:
-            raise Exception("Failed to get access token")
-
-        # Register IPN URL
-        ipn_url = f"{base_url}/payments/pesapal/ipn"
-        notification_response = pesapal.get_notification_id(
-            access_token, ipn_url
-        )
-        notification_id = notification_response["ipn_id"]
-
-        if not notification_id:
-            raise Exception("Failed to register IPN")
-
-        # Create merchant reference
-        merchant_reference = (
-            f"PAYMENT_{payment.paymentId}_{int(datetime.utcnow().timestamp())}"
-        )
-
-        # Prepare order details
-        order_details = {
-            "amount": amount,
-            "customer_name": customer_name,
-            "phone_number": phone_number,
-            "email_address": current_user.email,
-            "description": description,
-            "merchant_reference": merchant_reference,
-            "notification_id": notification_id,
-        }
-
-        # Create Pesapal order
-        order_response = pesapal.get_merchant_order_url(
-            order_details, access_token, base_url
-        )
-
-        if not order_response.get("order_tracking_id"):
-            raise Exception("Failed to create Pesapal order")
-
-        # Store interim payment record
-        PesapalInterimPayment.create(
-            {
-                "paymentId": payment.paymentId,
-                "orderTrackingId": order_response["order_tracking_id"],
-                "merchantReference": order_response["merchant_reference"],
-                "iframeSrc": order_response["redirect_url"],
-                "status": "SAVED",
-            }
-        )
+        # Pesapal order submission runs on the initiation worker pool;
+        # the browser polls /payments/api/status/<id> for the iframe URL.
+        # A job that cannot be handed over stays QUEUED until
+        # reconciliation resumes it.
+        try:
+            start_initiation(job.jobId)
+            current_app.logger.info(
+                f"✅ Payment initiation queued as job {job.jobId}"
+            )
+        except Exception as error:
+            current_app.logger.error(
+                f"❌ Could not start initiation job {job.jobId}: {error}"
+            )
 
-        current_app.logger.info("✅ Payment initiation successful")
-
-        return jsonify(
-            {
-                "success": True,
-                "payment_id": payment.paymentId,
-                "order_tracking_id": order_response["order_tracking_id"],
-                "iframe_src": order_response["redirect_url"],
-                "message": "Payment initiated successfully",
-            }
-        )
+        return jsonify(response_body), 202
 
     except Exception as error:
         db.session.rollback()
         current_app.logger.error(f"❌ Payment initiation error: {error}")
+        if pesapal.breaker.is_open():
+            return gateway_busy_response()
         return jsonify({"success": False, "error": str(error)}), 500
 
 
@@ -238,14 +335,22 @@ def payment_iframe(payment_id):
     interim_payment = PesapalInterimPayment.query.filter_by(
         paymentId=payment_id
     ).first()
-    if not interim_payment:
-        flash("Payment session not found", "error")
-        return redirect(url_for("payments.history"))
+    if interim_payment:
+        iframe_src = interim_payment.iframeSrc
+    else:
+        # Order may still be on its way to Pesapal; the page polls for it
+        job = PaymentInitiationJob.query.filter_by(
+            paymentId=payment_id
+        ).first()
+        if not job or job.status not in ("QUEUED", "RUNNING"):
+            flash("Payment session not found", "error")
+            return redirect(url_for("payments.history"))
+        iframe_src = None
 
     return render_template(
         "payments/iframe.html",
         payment=payment,
-        iframe_src=interim_payment.iframeSrc,
+        iframe_src=iframe_src,
     )
 
 
@@ -265,55 +370,34 @@ def pesapal_callback():
             flash("Payment tracking ID is missing", "error")
             return redirect(url_for("payments.history"))
 
-        # Get access token
-        token_response = pesapal.get_access_token()
-        access_token = token_response["token"]
-
-        if not access_token:
-            flash("Payment verification failed", "error")
-            return redirect(url_for("payments.history"))
-
-        # Check transaction status
-        status_response = pesapal.get_transaction_status(
-            order_tracking_id, access_token
-        )
-        payment_status = status_response.get("payment_status_description")
-
-        current_app.logger.info(f"💳 Payment status: {payment_status}")
-
-        # Find the interim payment record
-        interim_payment = PesapalInterimPayment.query.filter_by(
-            orderTrackingId=order_tracking_id
-        ).first()
+        result = process_transaction_update(order_tracking_id)
+        outcome = result["outcome"]
 
-        if not interim_payment:
+        if outcome == "not_found":
             flash("Payment record not found", "error")
             return redirect(url_for("payments.history"))
 
-        payment = interim_payment.payment
+        if outcome == "unavailable":
+            flash(GATEWAY_BUSY_MESSAGE, "warning")
+            return redirect(url_for("payments.history"))
 
-        if payment_status == "Completed":
-            # Update payment status
-            payment.updateStatus(
-                status="Completed",
-                receipt_number=status_response.get("confirmation_code"),
-                payment_method=f"Pesapal - {status_response.get('payment_method', 'Unknown')}",
-            )
+        if outcome == "error":
+            flash("Payment verification failed", "error")
+            return redirect(url_for("payments.history"))
 
-            # Update interim payment status
-            interim_payment.updateStatus("COMPLETED")
+        payment = result["payment"]
+        current_app.logger.info(
+            f"💳 Payment status: {payment.status} ({outcome})"
+        )
 
+        if payment.status == "Completed":
             current_app.logger.info("✅ Payment completed successfully")
             flash("Payment completed successfully!", "success")
             return redirect(
                 url_for("payments.success", payment_id=payment.paymentId)
             )
 
-        elif payment_status == "Failed":
-            # Update payment status
-            payment.updateStatus(status="Failed")
-            interim_payment.updateStatus("FAILED")
-
+        elif payment.status == "Failed":
             current_app.logger.info("❌ Payment failed")
             flash("Payment failed. Please try again.", "error")
             return redirect(url_for("payments.history"))
@@ -323,6 +407,7 @@ def pesapal_callback():
             return redirect(url_for("payments.history"))
 
     except Exception as error:
+        db.session.rollback()
         current_app.logger.error(f"❌ Callback error: {error}")
         flash("An error occurred during payment processing", "error")
         return redirect(url_for("payments.history"))
@@ -330,68 +415,33 @@ def pesapal_callback():
 
 @payments_bp.route("/pesapal/ipn")
 def pesapal_ipn():
-    """Handle Pesapal IPN notifications."""
-    try:
-        order_tracking_id = request.args.get("OrderTrackingId")
-        current_app.logger.info(
-            f"📢 IPN notification received for: {order_tracking_id}"
-        )
-
-        if not order_tracking_id:
-            return "Missing OrderTrackingId", 400
-
-        # Get access token
-        token_response = pesapal.get_access_token()
-        access_token = token_response["token"]
-
-        if not access_token:
-            return "Error: Cannot retrieve access token", 400
-
-        # Get transaction status
-        status_response = pesapal.get_transaction_status(
-            order_tracking_id, access_token
-        )
-        payment_status = status_response.get("payment_status_description")
-
-        # Find interim payment
-        interim_payment = PesapalInterimPayment.query.filter_by(
-            orderTrackingId=order_tracking_id
-        ).first()
-
-        if not interim_payment:
-            current_app.logger.error(
-                f"Interim payment not found for: {order_tracking_id}"
-            )
-            return "Payment record not found", 404
-
-        payment = interim_payment.payment
-
-        if payment_status == "Completed":
-            # Update payment status
-            payment.updateStatus(
-                status="Completed",
-                receipt_number=status_response.get("confirmation_code"),
-                payment_method=f"Pesapal - {status_response.get('payment_method', 'Unknown')}",
-            )
-            interim_payment.updateStatus("COMPLETED")
-
-            current_app.logger.info(
-                f"✅ IPN: Payment {payment.paymentId} completed"
-            )
-
-        elif payment_status == "Failed":
-            payment.updateStatus(status="Failed")
-            interim_payment.updateStatus("FAILED")
+    """Acknowledge a Pesapal IPN and queue it for processing."""
+    order_tracking_id = request.args.get("OrderTrackingId")
+    merchant_reference = request.args.get("OrderMerchantReference")
+    notification_type = request.args.get("OrderNotificationType", "IPNCHANGE")
+    current_app.logger.info(
+        f"📢 IPN notification received for: {order_tracking_id}"
+    )
 
-            current_app.logger.info(
-                f"❌ IPN: Payment {payment.paymentId} failed"
-            )
+    if not order_tracking_id:
+        return "Missing OrderTrackingId", 400
 
-        return "IPN processed", 200
+    ack = {
+        "orderNotificationType": notification_type,
+        "orderTrackingId": order_tracking_id,
+        "orderMerchantReference": merchant_reference,
+        "status": 200,
+    }
 
+    try:
+        accept_ipn(order_tracking_id, merchant_reference, notification_type)
     except Exception as error:
+        db.session.rollback()
         current_app.logger.error(f"❌ IPN error: {error}")
-        return "IPN processing error", 500
+        ack["status"] = 500
+        return jsonify(ack), 500
+
+    return jsonify(ack)
 
 
 # === PAYMENT STATUS AND HISTORY ===
@@ -402,14 +452,16 @@ def pesapal_ipn():
 @student_required
 def success(payment_id):
     """Show payment success page."""
-    payment = Payment.query.get_or_404(payment_id)
+    receipt = get_receipt(payment_id)
+    if receipt is None:
+        abort(404)
 
     # Ensure the payment belongs to the current user
-    if payment.studentId != current_user.student.student_id:
+    if receipt["student_id"] != current_user.student.student_id:
         flash("Access denied", "error")
         return redirect(url_for("payments.history"))
 
-    return render_template("payments/success.html", payment=payment)
+    return render_template("payments/success.html", receipt=receipt)
 
 
 @payments_bp.route("/history")
@@ -437,14 +489,82 @@ def api_payment_status(payment_id):
     if payment.studentId != current_user.student.student_id:
         return jsonify({"error": "Access denied"}), 403
 
-    return jsonify(
-        {
-            "payment_id": payment.paymentId,
-            "status": payment.status,
-            "amount": payment.amount,
-            "purpose": payment.purpose,
-        }
+    # Long-poll: ?wait=N&status=..&initiation=.. holds the request until
+    # the payment moves on from what the client last saw
+    wait = min(request.args.get("wait", 0, type=float), LONG_POLL_MAX_WAIT)
+    if wait <= 0:
+        return jsonify(payment_status_payload(payment))
+
+    with broker.subscribe(payment_channel(payment_id)) as subscription:
+        payload = payment_status_payload(payment)
+        known = (request.args.get("status"), request.args.get("initiation"))
+        if (payload["status"], payload["initiation"]) != known:
+            return jsonify(payload)
+
+        # Give the connection back to the pool while waiting
+        db.session.close()
+        return jsonify(subscription.get(timeout=wait) or payload)
+
+
+@payments_bp.route("/api/status/<int:payment_id>/stream")
+@login_required
+@student_required
+def api_payment_status_stream(payment_id):
+    """Server-Sent Events stream of a payment's status changes."""
+    payment = Payment.query.get_or_404(payment_id)
+
+    # Ensure the payment belongs to the current user
+    if payment.studentId != current_user.student.student_id:
+        return jsonify({"error": "Access denied"}), 403
+
+    # Subscribe before reading so a change in between is not missed
+    subscription = broker.subscribe(payment_channel(payment_id))
+    try:
+        payload = payment_status_payload(payment)
+    except Exception:
+        subscription.close()
+        raise
+    db.session.close()
+
+    def events():
+        yield f"retry: {STREAM_RETRY_MS}\ndata: {json.dumps(payload)}\n\n"
+        if payment_settled(payload):
+            return
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=STREAM_KEEPALIVE)
+            if message is None:
+                yield ": keep-alive\n\n"
+                continue
+            yield f"data: {json.dumps(message)}\n\n"
+            if payment_settled(message):
+                return
+
+    response = Response(
+        events(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
+    # The server closes the response even if the body is never read
+    response.call_on_close(subscription.close)
+    return response
+
+
+def payment_settled(payload):
+    """True once the status page has nothing left to wait for."""
+    return (
+        payload["status"] in ("Completed", "Failed")
+        or payload["initiation"] == "FAILED"
+    )
+
+
+def ledger_page_url(endpoint, cursor):
+    """URL of the next ledger page, keeping the current filters."""
+    if not cursor:
+        return None
+    args = request.args.to_dict()
+    args["after"] = cursor
+    return url_for(endpoint, **args)
 
 
 # === ADMIN ROUTES ===
@@ -455,9 +575,17 @@ def api_payment_status(payment_id):
 @admin_required
 def admin_pending_payments():
     """Admin view of pending payments."""
-    pending_payments = Payment.query.filter_by(status="Pending").all()
+    filters = {"status": "Pending"}
+    payments, next_cursor = payment_ledger.ledger_page(
+        filters, request.args.get("after")
+    )
     return render_template(
-        "payments/admin_pending.html", payments=pending_payments
+        "payments/admin_pending.html",
+        payments=payments,
+        pending_total=payment_ledger.ledger_summary(filters)["total"],
+        next_url=ledger_page_url(
+            "payments.admin_pending_payments", next_cursor
+        ),
     )
 
 
@@ -465,9 +593,124 @@ def admin_pending_payments():
 @login_required
 @admin_required
 def admin_all_payments():
-    """Admin view of all payments."""
-    payments = Payment.query.order_by(Payment.dateCreated.desc()).all()
-    return render_template("payments/admin_all.html", payments=payments)
+    """Admin view of all payments, filtered and paged in SQL."""
+    filters = payment_ledger.parse_filters(request.args)
+    payments, next_cursor = payment_ledger.ledger_page(
+        filters, request.args.get("after")
+    )
+
+    clubs = (
+        Club.query.with_entities(Club.club_id, Club.name)
+        .order_by(Club.name)
+        .all()
+    )
+    events = []
+    if "club_id" in filters:
+        events = (
+            Event.query.with_entities(Event.event_id, Event.title)
+            .filter_by(club_id=filters["club_id"])
+            .order_by(Event.event_date.desc())
+            .all()
+        )
+
+    return render_template(
+        "payments/admin_all.html",
+        payments=payments,
+        summary=payment_ledger.ledger_summary(filters),
+        clubs=clubs,
+        events=events,
+        is_first_page=not request.args.get("after"),
+        next_url=ledger_page_url("payments.admin_all_payments", next_cursor),
+    )
+
+
+@payments_bp.route("/admin/export")
+@login_required
+@admin_required
+def admin_export_payments():
+    """
+    Download the filtered ledger as CSV (streamed) or XLSX.
+
+    Takes the same filters as the all-payments page plus
+    format=csv|xlsx.
+    """
+    filters = payment_ledger.parse_filters(request.args)
+    filename = f"payments_{datetime.utcnow():%Y%m%d_%H%M%S}"
+
+    if request.args.get("format") == "xlsx":
+        # Spooled to an anonymous temp file rather than held in memory
+        output = tempfile.TemporaryFile()
+        try:
+            payment_ledger.write_xlsx(filters, output)
+        except ImportError:
+            output.close()
+            flash(
+                "XLSX export needs the xlsxwriter package; "
+                "download CSV instead.",
+                "warning",
+            )
+            args = request.args.to_dict()
+            args.pop("format", None)
+            return redirect(url_for("payments.admin_all_payments", **args))
+
+        output.seek(0)
+        return send_file(
+            output,
+            mimetype="application/vnd.openxmlformats-officedocument"
+            ".spreadsheetml.sheet",
+            as_attachment=True,
+            download_name=f"{filename}.xlsx",
+        )
+
+    return Response(
+        stream_with_context(payment_ledger.iter_csv(filters)),
+        mimetype="text/csv",
+        headers={
+            "Content-Disposition": f"attachment; filename={filename}.csv"
+        },
+    )
+
+
+@payments_bp.route("/admin/revenue")
+@login_required
+@admin_required
+def admin_revenue():
+    """Admin revenue dashboard, read from the daily totals table."""
+    filters = payment_ledger.parse_filters(request.args)
+    clubs = (
+        Club.query.with_entities(Club.club_id, Club.name)
+        .order_by(Club.name)
+        .all()
+    )
+    return render_template(
+        "payments/admin_revenue.html",
+        report=payment_ledger.revenue_report(filters),
+        clubs=clubs,
+    )
+
+
+@payments_bp.route("/api/revenue")
+@login_required
+@admin_required
+def api_revenue():
+    """Revenue report as JSON; same filters as the dashboard."""
+    filters = payment_ledger.parse_filters(request.args)
+    return jsonify(payment_ledger.revenue_report(filters))
+
+
+@payments_bp.route("/admin/gateway-health")
+@login_required
+@admin_required
+def admin_gateway_health():
+    """Pesapal circuit breaker, token cache and latency figures."""
+    return jsonify(
+        {
+            "circuit_breaker": pesapal.breaker.snapshot(),
+            "token_cache": pesapal.get_token_cache_stats(),
+            "endpoints": pesapal.get_endpoint_metrics(),
+            "live_status": broker.stats(),
+        }
+    )
 
 
 @payments_bp.route("/admin/mark-completed/<int:payment_id>", methods=["POST"])
@@ -482,6 +725,7 @@ def admin_mark_completed(payment_id):
         receipt_number=f"MANUAL_{payment_id}",
         payment_method="Manual Override",
     )
+    publish_payment_status(payment)
 
     flash(f"Payment {payment_id} marked as completed.", "success")
     return redirect(url_for("payments.admin_pending_payments"))
@@ -494,6 +738,108 @@ def admin_mark_failed(payment_id):
     """Admin manually mark payment as failed."""
     payment = Payment.query.get_or_404(payment_id)
     payment.updateStatus(status="Failed")
+    publish_payment_status(payment)
 
     flash(f"Payment {payment_id} marked as failed.", "info")
     return redirect(url_for("payments.admin_pending_payments"))
+
+
+# === CLI COMMANDS ===
+
+
+@payments_bp.cli.command("register-ipn")
+@click.option(
+    "--base-url",
+    default=lambda: os.environ.get("APP_BASE_URL"),
+    help="Public base URL of the site, e.g. https://philtait.me",
+)
+@click.option(
+    "--force", is_flag=True, help="Register again even if already stored."
+)
+def register_ipn_command(base_url, force):
+    """Register the Pesapal IPN URL and store its notification_id."""
+    if not base_url:
+        raise click.UsageError("Pass --base-url or set APP_BASE_URL.")
+
+    registration = register_ipn(base_url, force=force)
+    if registration is None:
+        raise click.ClickException("Pesapal IPN registration failed.")
+
+    click.echo(
+        f"{registration.ipnUrl} -> notification_id {registration.notificationId}"
+    )
+
+
+@payments_bp.cli.command("reconcile")
+@click.option(
+    "--older-than",
+    type=int,
+    default=lambda: current_app.config["PAYMENT_RECONCILE_AFTER"],
+    help="Only check payments pending for at least this many minutes.",
+)
+@click.option("--limit", default=500, show_default=True)
+@click.option(
+    "--workers",
+    type=int,
+    default=lambda: current_app.config["PAYMENT_RECONCILE_WORKERS"],
+)
+@click.option(
+    "--rate",
+    type=float,
+    default=lambda: current_app.config["PAYMENT_RECONCILE_RATE"],
+    help="Maximum Pesapal status lookups started per second.",
+)
+def reconcile_command(older_than, limit, workers, rate):
+    """Resolve stale Pending payments against Pesapal."""
+    try:
+        summary = reconcile_pending(
+            older_than=older_than,
+            limit=limit,
+            workers=workers,
+            rate=rate,
+        )
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    click.echo("Payment reconciliation summary")
+    for key, value in summary.items():
+        click.echo(f"  {key.replace('_', ' '):<20} {value}")
+
+
+@payments_bp.cli.command("drain-ipn")
+@click.option("--limit", default=500, show_default=True)
+@click.option(
+    "--retry-dead", is_flag=True, help="Re-queue dead-lettered IPNs first."
+)
+def drain_ipn_command(limit, retry_dead):
+    """Process queued Pesapal IPN notifications now."""
+    if retry_dead:
+        requeued = PesapalIpnInbox.query.filter_by(status="DEAD").update(
+            {
+                "status": "RECEIVED",
+                "attempts": 0,
+                "nextAttemptAt": datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+        db.session.commit()
+        click.echo(f"Re-queued {requeued} dead IPNs")
+
+    counts = drain_ipn_inbox(limit=limit)
+    if not counts:
+        click.echo("No IPNs due")
+    for status, count in sorted(counts.items()):
+        click.echo(f"  {status:<10} {count}")
+
+
+@payments_bp.cli.command("rebuild-totals")
+@click.option(
+    "--since",
+    type=click.DateTime(formats=["%Y-%m-%d"]),
+    help="Only rebuild days on or after this date (YYYY-MM-DD).",
+)
+def rebuild_totals_command(since):
+    """Recompute payment_daily_totals from the payment table."""
+    rows = PaymentDailyTotal.rebuild(since=since.date() if since else None)
+    db.session.commit()
+    click.echo(f"Rebuilt {rows} daily total rows")
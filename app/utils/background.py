@@ -0,0 +1,102 @@
+# File: app/utils/background.py
+
+import atexit
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundPool:
+    """
+    Thread pool that runs jobs inside the Flask application context.
+
+    The executor is created on first use with ``max_workers`` taken from
+    ``app.config[config_key]``, and is shut down (waiting for queued jobs)
+    when the process exits.
+    """
+
+    def __init__(self, name, config_key, default_workers=4):
+        self.name = name
+        self.config_key = config_key
+        self.default_workers = default_workers
+        self._executor = None
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def _get_executor(self, app):
+        with self._lock:
+            if self._executor is None:
+                workers = int(
+                    app.config.get(self.config_key, self.default_workers)
+                )
+                self._executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix=self.name
+                )
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` to run in an app context."""
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    logger.exception(f"{self.name} job {fn.__name__} failed")
+                    raise
+
+        return self._get_executor(app).submit(run)
+
+    def shutdown(self, wait=True):
+        """Stop accepting jobs; by default wait for queued ones to finish."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+class RateLimiter:
+    """Space calls evenly so no more than ``rate`` start per second."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def start_periodic(app, name, interval, fn, *args, **kwargs):
+    """
+    Run ``fn`` every ``interval`` seconds on a daemon thread.
+
+    Each run gets its own application context; errors are logged and the
+    schedule carries on.
+    """
+    stop = threading.Event()
+
+    def loop():
+        while not stop.wait(interval):
+            with app.app_context():
+                try:
+                    fn(*args, **kwargs)
+                except Exception:
+                    logger.exception(f"Scheduled job {name} failed")
+
+    thread = threading.Thread(target=loop, name=name, daemon=True)
+    thread.start()
+    return stop
@@ -4,13 +4,24 @@ from flask import current_app, url_for
 from flask_mail import Message
 from app.extensions import mail
 from app import s
+from app.utils.email_queue import email_queue
+import html
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Buffered messages listed in a rollup email; the rest are only counted
+ROLLUP_EMAIL_LINES = 50
 
-def send_email(to, subject, template, **kwargs):
-    """Send an email with error handling."""
+
+def send_email(to, subject, template, wait=False, **kwargs):
+    """
+    Send an email with error handling.
+
+    With MAIL_ASYNC on, the message is queued for the email workers and
+    True means it was queued, not delivered. ``wait`` sends it in this
+    call regardless, for callers that act on delivery.
+    """
     try:
         if not current_app.config.get("MAIL_USERNAME"):
             logger.warning("Email service not configured")
@@ -22,6 +33,8 @@ def send_email(to, subject, template, **kwargs):
             html=template,
             sender=current_app.config["MAIL_DEFAULT_SENDER"],
         )
+        if current_app.config.get("MAIL_ASYNC") and not wait:
+            return email_queue.enqueue(msg)
         mail.send(msg)
         return True
     except Exception as e:
@@ -210,3 +223,54 @@ def send_payment_receipt_email(user, payment):
     except Exception as e:
         logger.error(f"Error sending payment receipt email: {e}")
         return False
+
+
+def send_notification_digest_email(user, notifications):
+    """
+    Send a user the notifications collected for their digest. Sent
+    synchronously, so True means delivered and the items can go.
+    """
+    try:
+        items = "".join(
+            f"<li><strong>{html.escape(n.title)}</strong> "
+            f"({n.sent_on.strftime('%Y-%m-%d %H:%M')})"
+            f"<br>{html.escape(n.message)}</li>"
+            for n in notifications
+        )
+        body = f"""
+        <h2>Your Notification Digest</h2>
+        <p>Hello {html.escape(user.first_name)},</p>
+        <p>Here is what happened since your last digest:</p>
+        <ul>{items}</ul>
+        <p>Change how you are notified from the Notifications page.</p>
+        """
+
+        return send_email(
+            to=user.email,
+            subject=f"Notification Digest: {len(notifications)} updates",
+            template=body,
+            wait=True,
+        )
+    except Exception as e:
+        logger.error(f"Error sending notification digest email: {e}")
+        return False
+
+
+def send_rollup_email(recipient_emails, title, message, messages):
+    """Send a rollup of several similar notifications as one email."""
+    try:
+        shown = messages[:ROLLUP_EMAIL_LINES]
+        items = "".join(f"<li>{html.escape(m)}</li>" for m in shown)
+        more = len(messages) - len(shown)
+        body = f"""
+        <h2>{html.escape(title)}</h2>
+        <p>{html.escape(message)}</p>
+        <ul>{items}</ul>
+        """
+        if more:
+            body += f"<p>...and {more} more.</p>"
+
+        return send_email(to=recipient_emails, subject=title, template=body)
+    except Exception as e:
+        logger.error(f"Error sending notification rollup email: {e}")
+        return False
@@ -0,0 +1,100 @@
+# File: app/utils/email_queue.py
+
+import time
+import logging
+import threading
+
+from flask import current_app
+
+from app.extensions import mail
+from app.utils.background import BackgroundPool
+from app.utils.metrics import EndpointMetrics
+
+logger = logging.getLogger(__name__)
+
+# Longest pause between attempts at one message (seconds)
+MAIL_RETRY_MAX_DELAY = 30
+
+
+class EmailQueue:
+    """
+    Outgoing mail sent by a pool of worker threads.
+
+    Requests only build the message; the SMTP conversation happens on one
+    of ``app.config["MAIL_WORKERS"]`` threads, with up to
+    ``MAIL_MAX_ATTEMPTS`` tries per message. Whatever is still queued is
+    sent before the process exits.
+    """
+
+    def __init__(self):
+        self.pool = BackgroundPool("email", "MAIL_WORKERS", 2)
+        self.metrics = EndpointMetrics()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._in_flight = 0
+        self._sent = 0
+        self._failed = 0
+
+    def enqueue(self, msg):
+        """Queue a flask_mail Message for sending. Returns True."""
+        with self._lock:
+            self._queued += 1
+        try:
+            self.pool.submit(self._deliver, msg, time.monotonic())
+        except RuntimeError:
+            # The pool is gone (the process is exiting); send it here
+            with self._lock:
+                self._queued -= 1
+            mail.send(msg)
+        return True
+
+    def _deliver(self, msg, queued_at):
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+        self.metrics.record("queue_wait", time.monotonic() - queued_at)
+
+        attempts = max(1, int(current_app.config.get("MAIL_MAX_ATTEMPTS", 3)))
+        error = None
+        for attempt in range(1, attempts + 1):
+            started = time.monotonic()
+            try:
+                mail.send(msg)
+                error = None
+            except Exception as e:
+                error = e
+            self.metrics.record(
+                "smtp_send",
+                time.monotonic() - started,
+                ok=error is None,
+                retried=attempt > 1,
+            )
+            if error is None or attempt == attempts:
+                break
+            time.sleep(min(2**attempt, MAIL_RETRY_MAX_DELAY))
+
+        with self._lock:
+            self._in_flight -= 1
+            if error is None:
+                self._sent += 1
+            else:
+                self._failed += 1
+        if error is not None:
+            logger.error(
+                f"Failed to send email '{msg.subject}' after "
+                f"{attempts} attempts: {error}"
+            )
+
+    def stats(self):
+        """Queue depth, outcome counters and latency figures."""
+        with self._lock:
+            counters = {
+                "queued": self._queued,
+                "in_flight": self._in_flight,
+                "sent": self._sent,
+                "failed": self._failed,
+            }
+        return {**counters, "latency": self.metrics.snapshot()}
+
+
+email_queue = EmailQueue()
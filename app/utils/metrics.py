@@ -0,0 +1,52 @@
+# File: app/utils/metrics.py
+
+import threading
+from collections import deque
+
+
+class EndpointMetrics:
+    """Per-endpoint (or per-stage) call counts and latency, in memory."""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, endpoint, elapsed, ok=True, retried=False):
+        with self._lock:
+            stats = self._endpoints.setdefault(
+                endpoint,
+                {
+                    "calls": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "samples": deque(maxlen=self.window),
+                },
+            )
+            elapsed_ms = elapsed * 1000
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["samples"].append(elapsed_ms)
+            if not ok:
+                stats["errors"] += 1
+            if retried:
+                stats["retries"] += 1
+
+    def snapshot(self):
+        with self._lock:
+            result = {}
+            for endpoint, stats in self._endpoints.items():
+                samples = sorted(stats["samples"])
+                result[endpoint] = {
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "retries": stats["retries"],
+                    "avg_ms": round(stats["total_ms"] / stats["calls"], 1),
+                    "max_ms": round(stats["max_ms"], 1),
+                    "p50_ms": round(samples[len(samples) // 2], 1),
+                    "p95_ms": round(samples[int(len(samples) * 0.95)], 1),
+                }
+            return result
@@ -0,0 +1,78 @@
+# File: app/utils/notification_digest.py
+
+import logging
+
+from app.extensions import db
+from app.models.notification import Notification, NotificationDigestItem
+from app.models.user import User
+from app.utils.email import send_notification_digest_email
+
+logger = logging.getLogger(__name__)
+
+# Users handled per transaction
+DIGEST_BATCH_SIZE = 200
+
+
+def send_digests(batch_size=DIGEST_BATCH_SIZE):
+    """
+    Email every user with queued digest items one digest, then clear them.
+
+    Items of a user whose email could not be sent are kept for the next
+    run. Returns the number of digests sent.
+    """
+    sent = 0
+    last_user_id = 0
+    while True:
+        user_ids = db.session.scalars(
+            db.select(NotificationDigestItem.user_id)
+            .where(NotificationDigestItem.user_id > last_user_id)
+            .group_by(NotificationDigestItem.user_id)
+            .order_by(NotificationDigestItem.user_id)
+            .limit(batch_size)
+        ).all()
+        if not user_ids:
+            break
+        last_user_id = user_ids[-1]
+
+        users = {
+            user.user_id: user
+            for user in User.query.filter(User.user_id.in_(user_ids))
+        }
+        queued = {}
+        for item_id, user_id, notification in db.session.execute(
+            db.select(
+                NotificationDigestItem.id,
+                NotificationDigestItem.user_id,
+                Notification,
+            )
+            .join(
+                Notification,
+                Notification.notification_id
+                == NotificationDigestItem.notification_id,
+            )
+            .where(NotificationDigestItem.user_id.in_(user_ids))
+            .order_by(Notification.sent_on, Notification.notification_id)
+        ):
+            item_ids, notifications = queued.setdefault(user_id, ([], []))
+            item_ids.append(item_id)
+            notifications.append(notification)
+
+        done = []
+        for user_id, (item_ids, notifications) in queued.items():
+            user = users.get(user_id)
+            if user and send_notification_digest_email(user, notifications):
+                done.extend(item_ids)
+                sent += 1
+
+        if done:
+            db.session.execute(
+                db.delete(NotificationDigestItem).where(
+                    NotificationDigestItem.id.in_(done)
+                ),
+                execution_options={"synchronize_session": False},
+            )
+        db.session.commit()
+
+    if sent:
+        logger.info(f"Notification digests sent: {sent}")
+    return sent
@@ -0,0 +1,238 @@
+# File: app/utils/notification_retention.py
+
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import and_, exists, literal
+
+from app.extensions import db
+from app.models.notification import (
+    Notification,
+    NotificationArchive,
+    NotificationAudience,
+    UserNotification,
+    UserNotificationArchive,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows moved per transaction, so no run holds locks for long
+RETENTION_BATCH_SIZE = 1000
+
+
+def _move_receipts(condition, archive):
+    """Delete matching user_notifications rows, archiving them first."""
+    if archive:
+        db.session.execute(
+            db.insert(UserNotificationArchive).from_select(
+                ["id", "user_id", "notification_id", "read_at"],
+                db.select(
+                    UserNotification.id,
+                    UserNotification.user_id,
+                    UserNotification.notification_id,
+                    UserNotification.read_at,
+                ).where(condition),
+            )
+        )
+    return db.session.execute(
+        db.delete(UserNotification)
+        .where(condition)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+
+
+def _expire_read_receipts(cutoff, archive, batch_size):
+    """Remove direct notifications read before ``cutoff``."""
+    has_audience = exists().where(
+        NotificationAudience.notification_id
+        == UserNotification.notification_id
+    )
+    moved = 0
+    while True:
+        ids = [
+            row_id
+            for (row_id,) in db.session.query(UserNotification.id)
+            .filter(
+                UserNotification.is_read.is_(True),
+                UserNotification.read_at < cutoff,
+                # An audience notification's receipt is what marks it read
+                ~has_audience,
+            )
+            .order_by(UserNotification.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ]
+        if not ids:
+            return moved
+        moved += _move_receipts(UserNotification.id.in_(ids), archive)
+        db.session.commit()
+
+
+def _expire_audience_notifications(cutoff, archive):
+    """
+    Withdraw audience notifications sent before ``cutoff``.
+
+    One notification per transaction: its receipts and audience rows go,
+    and members who never read it stop counting it as unread. The
+    notification itself is left for _compact_notifications.
+    """
+    expired = 0
+    while True:
+        notification_id = (
+            db.session.query(NotificationAudience.notification_id)
+            .join(
+                Notification,
+                Notification.notification_id
+                == NotificationAudience.notification_id,
+            )
+            .filter(Notification.sent_on < cutoff)
+            .order_by(NotificationAudience.notification_id)
+            .limit(1)
+            .with_for_update(skip_locked=True, of=NotificationAudience)
+            .scalar()
+        )
+        if notification_id is None:
+            return expired
+
+        # Lock all of its audience rows; another run may have taken one
+        # of them and archived the receipts while this one waited
+        audiences = (
+            NotificationAudience.query.filter_by(
+                notification_id=notification_id
+            )
+            .with_for_update()
+            .populate_existing()
+            .all()
+        )
+        if not audiences:
+            db.session.commit()
+            continue
+
+        _move_receipts(
+            UserNotification.notification_id == notification_id, archive
+        )
+        db.session.execute(
+            db.delete(NotificationAudience)
+            .where(NotificationAudience.notification_id == notification_id)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        expired += 1
+
+
+def _compact_notifications(cutoff, archive, batch_size):
+    """Remove notifications sent before ``cutoff`` that nobody holds."""
+    orphaned = and_(
+        Notification.sent_on < cutoff,
+        ~exists().where(
+            UserNotification.notification_id == Notification.notification_id
+        ),
+        ~exists().where(
+            NotificationAudience.notification_id
+            == Notification.notification_id
+        ),
+    )
+    removed = 0
+    while True:
+        ids = [
+            notification_id
+            for (notification_id,) in db.session.query(
+                Notification.notification_id
+            )
+            .filter(orphaned)
+            .order_by(Notification.notification_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        ]
+        if not ids:
+            return removed
+        selected = Notification.notification_id.in_(ids)
+        if archive:
+            db.session.execute(
+                db.insert(NotificationArchive).from_select(
+                    [
+                        "notification_id",
+                        "title",
+                        "message",
+                        "notification_type",
+                        "related_id",
+                        "sent_on",
+                        "archived_on",
+                    ],
+                    db.select(
+                        Notification.notification_id,
+                        Notification.title,
+                        Notification.message,
+                        Notification.notification_type,
+                        Notification.related_id,
+                        Notification.sent_on,
+                        literal(datetime.utcnow()),
+                    ).where(selected),
+                )
+            )
+        removed += db.session.execute(
+            db.delete(Notification)
+            .where(selected)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+
+
+def purge_notifications(
+    days, archive=True, batch_size=RETENTION_BATCH_SIZE
+):
+    """
+    Apply the retention policy to notifications older than ``days``.
+
+    - Direct notifications a user read more than ``days`` ago leave
+      their inbox.
+    - Audience notifications sent more than ``days`` ago are withdrawn
+      from everyone.
+    - Notifications left with no recipients are removed.
+
+    Rows are moved in batches of ``batch_size``, one transaction each.
+    With ``archive`` they are copied to the archive tables first;
+    otherwise they are deleted outright. Each batch is picked with
+    SELECT ... FOR UPDATE SKIP LOCKED, so overlapping runs share the rows
+    out instead of archiving or un-counting the same ones twice. Returns
+    the number of rows removed at each step.
+    """
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    summary = {
+        "read_receipts": 0,
+        "audience_notifications": 0,
+        "notifications": 0,
+    }
+    try:
+        summary["read_receipts"] = _expire_read_receipts(
+            cutoff, archive, batch_size
+        )
+        summary["audience_notifications"] = _expire_audience_notifications(
+            cutoff, archive
+        )
+        summary["notifications"] = _compact_notifications(
+            cutoff, archive, batch_size
+        )
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Notification retention run failed: {e}")
+        raise
+
+    logger.info(
+        f"Notification retention ({days} days, "
+        f"{'archived' if archive else 'deleted'}): {summary}"
+    )
+    return summary
+
+
+def purge_from_config():
+    """Run purge_notifications with the NOTIFICATION_RETENTION_* settings."""
+    config = current_app.config
+    return purge_notifications(
+        days=config.get("NOTIFICATION_RETENTION_DAYS", 90),
+        archive=config.get("NOTIFICATION_RETENTION_ARCHIVE", True),
+        batch_size=config.get(
+            "NOTIFICATION_RETENTION_BATCH", RETENTION_BATCH_SIZE
+        ),
+    )
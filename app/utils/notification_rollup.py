@@ -0,0 +1,161 @@
+# File: app/utils/notification_rollup.py
+
+import atexit
+import logging
+import threading
+import time
+
+from flask import current_app
+
+from app.utils.email import send_rollup_email
+from app.utils.notifications import send_notification
+
+logger = logging.getLogger(__name__)
+
+class NotificationCoalescer:
+    """
+    Fold bursts of similar notifications into periodic rollups.
+
+    Notifications are grouped by type, related ID, recipient and title.
+    The first of a group is sent at once and opens a window of
+    ``app.config[config_key]`` seconds; any more that arrive within it
+    are held and go out together as one rollup when it closes. A window
+    of 0 sends everything immediately.
+
+    Buffers live in the process, so each worker rolls up its own share
+    of a burst. Anything still buffered is sent when the process exits.
+    """
+
+    def __init__(self, config_key, default_window=60):
+        self.config_key = config_key
+        self.default_window = default_window
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self._app = None
+        atexit.register(self.flush)
+
+    def notify(
+        self,
+        title,
+        message,
+        notification_type,
+        related_id,
+        user_id,
+        rollup_title,
+        rollup_message,
+        email_to=None,
+        club_id=None,
+    ):
+        """
+        Send a notification, or hold it for the recipient's next rollup.
+
+        ``rollup_title`` and ``rollup_message`` describe a rollup, with
+        ``{count}`` replaced by the number of notifications it stands for.
+        If ``email_to`` is given, rollups are emailed there as well.
+        ``club_id`` is passed on to ``send_notification`` so the
+        recipient's club preferences apply.
+
+        Returns True if the notification was sent now (so the caller
+        should send its usual email), False if it joined a rollup.
+        """
+        window = float(
+            current_app.config.get(self.config_key, self.default_window)
+        )
+        if window > 0:
+            key = (notification_type, related_id, user_id, title)
+            with self._lock:
+                rollup = self._pending.get(key)
+                if rollup is not None:
+                    rollup["messages"].append(message)
+                    return False
+
+                self._pending[key] = {
+                    "due": time.monotonic() + window,
+                    "notification_type": notification_type,
+                    "related_id": related_id,
+                    "user_id": user_id,
+                    "title": rollup_title,
+                    "message": rollup_message,
+                    "email_to": email_to,
+                    "club_id": club_id,
+                    "messages": [],
+                }
+                self._app = current_app._get_current_object()
+                self._ensure_flusher()
+                self._wakeup.notify()
+
+        send_notification(
+            title,
+            message,
+            notification_type,
+            related_id,
+            [user_id],
+            club_id=club_id,
+        )
+        return True
+
+    def flush(self):
+        """Send every buffered rollup now, whether or not it is due."""
+        with self._lock:
+            ready, self._pending = list(self._pending.values()), {}
+        self._emit_all(ready)
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(
+            target=self._run, name="notification-rollup", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                due = [k for k, r in self._pending.items() if r["due"] <= now]
+                if not due:
+                    next_due = min(
+                        (r["due"] for r in self._pending.values()),
+                        default=None,
+                    )
+                    self._wakeup.wait(
+                        None if next_due is None else next_due - now
+                    )
+                    continue
+                ready = [self._pending.pop(key) for key in due]
+            self._emit_all(ready)
+
+    def _emit_all(self, rollups):
+        rollups = [r for r in rollups if r["messages"]]
+        if not rollups or self._app is None:
+            return
+        with self._app.app_context():
+            for rollup in rollups:
+                try:
+                    self._emit(rollup)
+                except Exception:
+                    logger.exception("Could not send notification rollup")
+
+    def _emit(self, rollup):
+        count = str(len(rollup["messages"]))
+        title = rollup["title"].replace("{count}", count)
+        message = rollup["message"].replace("{count}", count)
+        send_notification(
+            title,
+            message,
+            rollup["notification_type"],
+            rollup["related_id"],
+            [rollup["user_id"]],
+            club_id=rollup["club_id"],
+        )
+
+        if rollup["email_to"]:
+            send_rollup_email(
+                rollup["email_to"], title, message, rollup["messages"]
+            )
+        logger.info(f"Notification rollup sent: {title}")
+
+
+coalescer = NotificationCoalescer("NOTIFICATION_COALESCE_WINDOW")
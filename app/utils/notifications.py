@@ -1,13 +1,267 @@
 # File: app/utils/notifications.py
 
 from app.extensions import db
-from app.models.notification import Notification, UserNotification
+from app.models.club_leader import ClubLeader
+from app.models.membership import Membership
+from app.models.notification import (
+    Notification,
+    NotificationAudience,
+    NotificationDigestItem,
+    NotificationPreference,
+    UserNotification,
+)
+from app.models.student import Student
+from app.models.user import User
+from app.utils.pubsub import broker
 from datetime import datetime
+from sqlalchemy import and_, case, exists, false, func, literal, or_, union
+from sqlalchemy.exc import IntegrityError
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+# Recipients are written with one multi-row INSERT per chunk
+NOTIFICATION_INSERT_CHUNK = 1000
+
+# Users whose unread counters are recomputed per UPDATE when repairing
+UNREAD_REPAIR_CHUNK = 1000
+
+NOTIFICATION_PAGE_SIZE = 20
+
+_CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+
+
+def notification_payload(notification, is_read=False):
+    """JSON-friendly view of a notification, as the inbox shows it."""
+    return {
+        "notification_id": notification.notification_id,
+        "title": notification.title,
+        "message": notification.message,
+        "notification_type": notification.notification_type,
+        "sent_on": notification.sent_on.isoformat(),
+        "sent_on_display": notification.sent_on.strftime(
+            "%b %d, %Y at %I:%M %p"
+        ),
+        "is_read": is_read,
+    }
+
+
+def user_channel(user_id):
+    """Pub/sub channel for one user's notifications and unread count."""
+    return f"notifications:user:{user_id}"
+
+
+def audience_channel(club_id=None, role=None):
+    """Pub/sub channel for notifications sent to an audience."""
+    if club_id is not None:
+        return f"notifications:club:{club_id}"
+    if role is not None:
+        return f"notifications:role:{role}"
+    return "notifications:all"
+
+
+def notification_channels(user):
+    """Every channel a user's live notification feed listens on."""
+    club_ids = [
+        club_id for (club_id,) in db.session.execute(user_club_ids(user))
+    ]
+    return [
+        user_channel(user.user_id),
+        audience_channel(),
+        audience_channel(role=user.role),
+    ] + [audience_channel(club_id=club_id) for club_id in club_ids]
+
+
+def _publish(channels, message):
+    """
+    Push a message to live feeds. Call after the change is committed.
+
+    Failures are logged, never raised: feeds catch up on reconnect.
+    """
+    try:
+        broker.publish_many(channels, message)
+    except Exception as e:
+        logger.error(f"Could not publish notification event: {e}")
+
+
+def adjust_unread_counts(condition, delta):
+    """Add ``delta`` to the matching users' unread counters, in SQL."""
+    # Never below zero, even if the counter has drifted low
+    count = case(
+        (User.unread_count + delta > 0, User.unread_count + delta), else_=0
+    )
+    db.session.execute(
+        db.update(User).where(condition).values(unread_count=count),
+        execution_options={"synchronize_session": False},
+    )
+
+
+def resolve_deliveries(user_ids, notification_type, club_id=None):
+    """
+    How each of ``user_ids`` wants a notification delivered.
+
+    Reads every preference that could apply in one query and keeps the
+    most specific per user: type and club, then club, then type, then
+    the catch-all. Returns ``{user_id: delivery}``; users without a
+    matching preference get 'Email'.
+    """
+    user_ids = list(dict.fromkeys(user_ids or ()))
+    deliveries = dict.fromkeys(user_ids, "Email")
+    if not user_ids:
+        return deliveries
+
+    club_match = NotificationPreference.club_id.is_(None)
+    if club_id is not None:
+        club_match = or_(club_match, NotificationPreference.club_id == club_id)
+    rows = db.session.execute(
+        db.select(
+            NotificationPreference.user_id,
+            NotificationPreference.notification_type,
+            NotificationPreference.club_id,
+            NotificationPreference.delivery,
+        ).where(
+            NotificationPreference.user_id.in_(user_ids),
+            or_(
+                NotificationPreference.notification_type.is_(None),
+                NotificationPreference.notification_type == notification_type,
+            ),
+            club_match,
+        )
+    )
+
+    best = {}
+    for user_id, pref_type, pref_club, delivery in rows:
+        rank = _preference_rank(pref_type, pref_club)
+        if rank >= best.get(user_id, -1):
+            best[user_id] = rank
+            deliveries[user_id] = delivery
+    return deliveries
+
+
+def _preference_rank(notification_type, club_id):
+    """How specific a preference is: type and club > club > type > any."""
+    return (club_id is not None) * 2 + (notification_type is not None)
+
+
+def load_preferences(user):
+    """A user's preferences as (notification_type, club_id, delivery)."""
+    return [
+        tuple(row)
+        for row in db.session.execute(
+            db.select(
+                NotificationPreference.notification_type,
+                NotificationPreference.club_id,
+                NotificationPreference.delivery,
+            ).where(NotificationPreference.user_id == user.user_id)
+        )
+    ]
+
+
+def pick_delivery(preferences, notification_type, club_id=None):
+    """
+    The delivery ``preferences`` (from load_preferences) give one
+    notification, the most specific matching one winning as in
+    resolve_deliveries.
+    """
+    best, chosen = -1, "Email"
+    for pref_type, pref_club, delivery in preferences:
+        if pref_type not in (None, notification_type):
+            continue
+        if pref_club not in (None, club_id):
+            continue
+        rank = _preference_rank(pref_type, pref_club)
+        if rank > best:
+            best, chosen = rank, delivery
+    return chosen
+
+
+def shows_in_feed(preferences, message):
+    """
+    Whether a live feed event should reach a user with ``preferences``.
+
+    Direct notifications were filtered when they were sent; audience
+    ones are checked here, as the inbox checks them.
+    """
+    if message.get("event") != "notification" or "audience" not in message:
+        return True
+    notification_type = message["notification"]["notification_type"]
+    delivery = pick_delivery(
+        preferences, notification_type, message.get("club_id")
+    )
+    return delivery != "Off"
+
+
+def email_recipients(
+    recipients, notification_type, club_id=None, notification_id=None
+):
+    """
+    Narrow ``(user_id, email)`` pairs to those who want this by email.
+
+    Users on a digest are left out; if ``notification_id`` is given, the
+    notification is queued for their next digest instead. Returns the
+    email addresses to send to.
+    """
+    recipients = list(recipients)
+    deliveries = resolve_deliveries(
+        [user_id for user_id, _ in recipients], notification_type, club_id
+    )
+    if notification_id is not None:
+        _queue_digest(
+            [u for u, d in deliveries.items() if d == "Digest"],
+            notification_id,
+        )
+        db.session.commit()
+    return list(
+        dict.fromkeys(
+            email
+            for user_id, email in recipients
+            if email and deliveries[user_id] == "Email"
+        )
+    )
+
+
+def _queue_digest(user_ids, notification_id):
+    rows = [
+        {"user_id": user_id, "notification_id": notification_id}
+        for user_id in user_ids
+    ]
+    for start in range(0, len(rows), NOTIFICATION_INSERT_CHUNK):
+        db.session.execute(
+            db.insert(NotificationDigestItem),
+            rows[start : start + NOTIFICATION_INSERT_CHUNK],
+        )
+
+
+def set_preferences(user, preferences):
+    """
+    Replace a user's notification preferences.
+
+    ``preferences`` maps ``(notification_type, club_id)`` to a delivery,
+    either of which may be None to cover any. Audience notifications
+    are matched against preferences at read time, so the inbox and badge
+    follow at once.
+    """
+    db.session.execute(
+        db.delete(NotificationPreference).where(
+            NotificationPreference.user_id == user.user_id
+        ),
+        execution_options={"synchronize_session": False},
+    )
+    rows = [
+        {
+            "user_id": user.user_id,
+            "notification_type": notification_type,
+            "club_id": club_id,
+            "delivery": delivery,
+        }
+        for (notification_type, club_id), delivery in preferences.items()
+    ]
+    if rows:
+        db.session.execute(db.insert(NotificationPreference), rows)
+    db.session.commit()
+
+
 def send_notification(
     title,
     message,
@@ -15,10 +269,16 @@ def send_notification(
     related_id=None,
     user_ids=None,
     via_email=True,
+    club_id=None,
 ):
     """
     Send a notification to multiple users.
 
+    Recipients' preferences are checked first, in one query: users who
+    switched this kind of notification off are dropped before anything
+    is written, and if ``via_email`` is set those on a digest have it
+    queued for their next one.
+
     Args:
         title: Notification title
         message: Notification message
@@ -26,10 +286,16 @@ def send_notification(
         related_id: Related object ID (optional)
         user_ids: List of user IDs to send to
         via_email: Whether to also send email notification
+        club_id: Club the notification is about, for club preferences
+
+    Returns the number of users notified (0 if nothing was sent).
     """
     try:
+        # Drop duplicates, keeping the caller's order
+        deliveries = resolve_deliveries(user_ids, notification_type, club_id)
+        user_ids = [u for u, d in deliveries.items() if d != "Off"]
         if not user_ids:
-            return False
+            return 0
 
         # Create the notification
         notification = Notification(
@@ -44,73 +310,549 @@ def send_notification(
         db.session.add(notification)
         db.session.flush()  # Get the notification ID
 
-        # Create user notifications
-        for user_id in user_ids:
-            user_notification = UserNotification(
-                user_id=user_id,
-                notification_id=notification.notification_id,
-                is_read=False,
+        # Create user notifications as plain rows, bypassing the ORM
+        # unit of work so large fan-outs stay cheap
+        rows = [
+            {
+                "user_id": user_id,
+                "notification_id": notification.notification_id,
+                "is_read": False,
+            }
+            for user_id in user_ids
+        ]
+        payload = notification_payload(notification)
+        for start in range(0, len(rows), NOTIFICATION_INSERT_CHUNK):
+            db.session.execute(
+                db.insert(UserNotification),
+                rows[start : start + NOTIFICATION_INSERT_CHUNK],
+            )
+            adjust_unread_counts(
+                User.user_id.in_(
+                    user_ids[start : start + NOTIFICATION_INSERT_CHUNK]
+                ),
+                1,
+            )
+        if via_email:
+            _queue_digest(
+                [u for u in user_ids if deliveries[u] == "Digest"],
+                notification.notification_id,
             )
-            db.session.add(user_notification)
 
         db.session.commit()
-        logger.info(f"Notification sent to {len(user_ids)} users: {title}")
-        return True
+        logger.info(f"Notification sent to {len(rows)} users: {title}")
+        _publish(
+            [user_channel(user_id) for user_id in user_ids],
+            {"event": "notification", "notification": payload},
+        )
+        return len(rows)
 
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error sending notification: {e}")
-        return False
+        return 0
 
 
-def mark_notification_read(user_id, notification_id):
-    """Mark a specific notification as read for a user."""
+def notify_audience(
+    title,
+    message,
+    notification_type,
+    related_id=None,
+    club_id=None,
+    role=None,
+    via_email=False,
+):
+    """
+    Send a notification to a whole group with a single row.
+
+    The audience is the members and leaders of ``club_id`` if given,
+    otherwise every user with ``role``, otherwise everyone. Recipients
+    are resolved when they read their inbox, so the cost of sending does
+    not depend on the size of the group.
+
+    Returns the Notification, or None if it could not be sent.
+    """
+    if club_id is not None:
+        audience = NotificationAudience(audience_type="Club", club_id=club_id)
+    elif role is not None:
+        audience = NotificationAudience(audience_type="Role", role=role)
+    else:
+        audience = NotificationAudience(audience_type="All")
+
     try:
-        user_notification = UserNotification.query.filter_by(
-            user_id=user_id, notification_id=notification_id
-        ).first()
+        notification = Notification(
+            title=title,
+            message=message,
+            notification_type=notification_type,
+            related_id=related_id,
+            via_email=via_email,
+            sent_on=datetime.utcnow(),
+        )
+        notification.audiences.append(audience)
+        db.session.add(notification)
+        db.session.flush()
+        payload = notification_payload(notification)
+        db.session.commit()
+        logger.info(
+            f"Notification sent to {audience.audience_type} audience: {title}"
+        )
+        _publish(
+            [audience_channel(club_id=club_id, role=role)],
+            {
+                "event": "notification",
+                "notification": payload,
+                "audience": audience.audience_type,
+                "club_id": club_id,
+            },
+        )
+        return notification
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error sending audience notification: {e}")
+        return None
+
+
+def user_club_ids(user):
+    """
+    Select the IDs of clubs ``user`` belongs to or leads.
+
+    ``user`` may also be the User class, for a correlated select.
+    """
+    memberships = (
+        db.select(Membership.club_id)
+        .join(Student, Student.student_id == Membership.student_id)
+        .where(
+            Student.user_id == user.user_id,
+            Membership.status == "Approved",
+            Membership.left_on.is_(None),
+        )
+        .correlate(User)
+    )
+    leaderships = (
+        db.select(ClubLeader.club_id)
+        .where(ClubLeader.user_id == user.user_id)
+        .correlate(User)
+    )
+    return union(memberships, leaderships)
 
-        if user_notification and not user_notification.is_read:
-            user_notification.is_read = True
-            user_notification.read_at = datetime.utcnow()
-            db.session.commit()
-            return True
-        return False
 
+def _since(start):
+    """
+    Notification.sent_on is not before ``start``, a column or a value;
+    a NULL ``start`` sets no bound.
+    """
+    return Notification.sent_on >= func.coalesce(start, Notification.sent_on)
+
+
+def _in_club_when_sent(user):
+    """
+    Correlated EXISTS: ``user`` was an approved member or a leader of the
+    row's audience club when the notification was sent, and still is.
+    """
+    member = (
+        exists()
+        .where(
+            Membership.club_id == NotificationAudience.club_id,
+            Membership.student_id == Student.student_id,
+            Student.user_id == user.user_id,
+            Membership.status == "Approved",
+            Membership.left_on.is_(None),
+            _since(Membership.joined_on),
+        )
+        .correlate(Notification, NotificationAudience, User)
+    )
+    leader = (
+        exists()
+        .where(
+            ClubLeader.club_id == NotificationAudience.club_id,
+            ClubLeader.user_id == user.user_id,
+            _since(ClubLeader.assigned_date),
+        )
+        .correlate(Notification, NotificationAudience, User)
+    )
+    return or_(member, leader)
+
+
+def _audience_delivery(user):
+    """
+    Correlated select of the delivery ``user`` picked for the audience
+    notification in the current row: the most specific preference, as
+    in resolve_deliveries, or NULL if none applies.
+    """
+    return (
+        db.select(NotificationPreference.delivery)
+        .where(
+            NotificationPreference.user_id == user.user_id,
+            or_(
+                NotificationPreference.notification_type.is_(None),
+                NotificationPreference.notification_type
+                == Notification.notification_type,
+            ),
+            or_(
+                NotificationPreference.club_id.is_(None),
+                NotificationPreference.club_id == NotificationAudience.club_id,
+            ),
+        )
+        .order_by(
+            NotificationPreference.club_id.is_(None),
+            NotificationPreference.notification_type.is_(None),
+        )
+        .limit(1)
+        .correlate(Notification, NotificationAudience, User)
+        .scalar_subquery()
+    )
+
+
+def audience_filter(user):
+    """
+    WHERE clause matching the NotificationAudience rows ``user`` is in
+    and has not switched off. The query must join Notification.
+
+    Nobody sees what was sent before they could have received it:
+    everyone and role notices from when the account was created, club
+    notices from when the user joined or began leading the club.
+
+    ``user`` may also be the User class, for a clause correlated with the
+    users table.
+    """
+    return and_(
+        or_(
+            and_(
+                NotificationAudience.audience_type == "All",
+                _since(user.created_at),
+            ),
+            and_(
+                NotificationAudience.audience_type == "Role",
+                NotificationAudience.role == user.role,
+                _since(user.created_at),
+            ),
+            and_(
+                NotificationAudience.audience_type == "Club",
+                _in_club_when_sent(user),
+            ),
+        ),
+        func.coalesce(_audience_delivery(user), "Email") != "Off",
+    )
+
+
+def _has_user_row(user):
+    """Correlated EXISTS for the user's own row of an audience notification."""
+    return (
+        exists()
+        .where(
+            UserNotification.notification_id
+            == NotificationAudience.notification_id,
+            UserNotification.user_id == user.user_id,
+        )
+        .correlate(NotificationAudience, User)
+    )
+
+
+def mark_notifications_read(user, notification_ids=None, before=None):
+    """
+    Mark many notifications as read for a user in one transaction.
+
+    Marks the given ``notification_ids``, or everything at or older than
+    the ``before`` cursor. Direct notifications are flipped with a
+    single UPDATE, which the unread counter drops by; audience
+    notifications the user has not read yet get their per-user rows from
+    a single INSERT ... SELECT.
+
+    Returns the number of notifications marked read.
+    """
+    if notification_ids is not None:
+        selected = Notification.notification_id.in_(list(notification_ids))
+    else:
+        position = decode_cursor(before)
+        if position is None:
+            return 0
+        sent_on, notification_id = position
+        selected = or_(
+            Notification.sent_on < sent_on,
+            and_(
+                Notification.sent_on == sent_on,
+                Notification.notification_id <= notification_id,
+            ),
+        )
+    now = datetime.utcnow()
+
+    try:
+        marked = db.session.execute(
+            db.update(UserNotification)
+            .where(
+                UserNotification.user_id == user.user_id,
+                UserNotification.is_read.is_(False),
+                UserNotification.notification_id.in_(
+                    db.select(Notification.notification_id).where(selected)
+                ),
+            )
+            .values(is_read=True, read_at=now)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if marked:
+            adjust_unread_counts(User.user_id == user.user_id, -marked)
+
+        unread_shared = (
+            db.select(
+                literal(user.user_id),
+                NotificationAudience.notification_id,
+                literal(True),
+                literal(now),
+            )
+            .join(
+                Notification,
+                Notification.notification_id
+                == NotificationAudience.notification_id,
+            )
+            .where(audience_filter(user), ~_has_user_row(user), selected)
+            .distinct()
+        )
+        marked += db.session.execute(
+            db.insert(UserNotification).from_select(
+                ["user_id", "notification_id", "is_read", "read_at"],
+                unread_shared,
+            )
+        ).rowcount
+
+        db.session.commit()
+        if marked:
+            # Keeps the badge right in the user's other tabs
+            unread = unread_badge_count(user)
+            _publish(
+                [user_channel(user.user_id)],
+                {"event": "unread", "unread_count": unread},
+            )
+        return marked
+
+    except IntegrityError:
+        # Raced another mark-read for the same user; it stored the rows
+        db.session.rollback()
+        return 0
     except Exception as e:
         db.session.rollback()
-        logger.error(f"Error marking notification as read: {e}")
-        return False
+        logger.error(f"Error marking notifications as read: {e}")
+        return 0
+
+
+def mark_notification_read(user, notification_id):
+    """Mark a specific notification as read for a user."""
+    return mark_notifications_read(user, [notification_id]) > 0
+
 
+def _shared_unread(user):
+    """
+    Select the number of audience notifications ``user`` has not read,
+    i.e. has no row for yet.
+
+    ``user`` may also be the User class, for a correlated count.
+    """
+    return (
+        db.select(func.count(NotificationAudience.notification_id.distinct()))
+        .join(
+            Notification,
+            Notification.notification_id
+            == NotificationAudience.notification_id,
+        )
+        .where(audience_filter(user), ~_has_user_row(user))
+    )
+
+
+def unread_badge_count(user):
+    """
+    The number on a user's notification badge, in one query.
 
-def get_unread_count(user_id):
-    """Get count of unread notifications for a user."""
+    Direct notifications come from the cached ``User.unread_count``;
+    audience ones are counted when the badge is read, so sending to an
+    audience never touches the users table.
+    """
+    return (
+        db.session.execute(
+            db.select(
+                User.unread_count + _shared_unread(User).scalar_subquery()
+            ).where(User.user_id == user.user_id)
+        ).scalar()
+        or 0
+    )
+
+
+def get_unread_count(user):
+    """
+    Count a user's unread notifications from the notification tables.
+
+    Direct notifications are unread until marked; audience ones are
+    unread while the user has no row for them yet. The badge uses the
+    cached ``User.unread_count`` for the direct part instead; this is
+    the exact figure.
+    """
     try:
-        count = UserNotification.query.filter_by(
-            user_id=user_id, is_read=False
+        direct = UserNotification.query.filter_by(
+            user_id=user.user_id, is_read=False
         ).count()
-        return count
+        shared = db.session.execute(_shared_unread(user)).scalar()
+        return direct + (shared or 0)
     except Exception as e:
         logger.error(f"Error getting unread count: {e}")
         return 0
 
 
-def get_user_notifications(user_id, limit=50):
-    """Get notifications for a user with pagination."""
+def encode_cursor(notification):
+    """Opaque position just after ``notification`` in newest-first order."""
+    return (
+        f"{notification.sent_on.strftime(_CURSOR_FORMAT)}"
+        f"-{notification.notification_id}"
+    )
+
+
+def decode_cursor(cursor):
+    """Return (sent_on, notification_id) for a cursor, or None if invalid."""
     try:
-        notifications = (
-            db.session.query(UserNotification, Notification)
+        sent_on, notification_id = cursor.split("-")
+        return datetime.strptime(sent_on, _CURSOR_FORMAT), int(notification_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _newest_first(query, position, limit):
+    """
+    Order ``query`` newest first, starting after ``position``.
+
+    Rows without a ``sent_on`` have no place in the order, and would
+    break merging the direct and audience halves, so they are skipped.
+    """
+    query = query.filter(Notification.sent_on.is_not(None))
+    if position:
+        sent_on, notification_id = position
+        query = query.filter(
+            or_(
+                Notification.sent_on < sent_on,
+                and_(
+                    Notification.sent_on == sent_on,
+                    Notification.notification_id < notification_id,
+                ),
+            )
+        )
+    return query.order_by(
+        Notification.sent_on.desc(), Notification.notification_id.desc()
+    ).limit(limit)
+
+
+def get_user_notifications(user, cursor=None, limit=NOTIFICATION_PAGE_SIZE):
+    """
+    Get one page of a user's notifications, newest first.
+
+    Direct and audience notifications are paged separately with keyset
+    pagination on (sent_on, notification_id) and merged, so a page
+    costs the same however long the user's history is. Returns
+    ((Notification, is_read) pairs, next_cursor); next_cursor is None
+    on the last page.
+    """
+    try:
+        position = decode_cursor(cursor)
+        direct = _newest_first(
+            db.session.query(Notification.sent_on, Notification.notification_id)
             .join(
-                Notification,
+                UserNotification,
                 UserNotification.notification_id
                 == Notification.notification_id,
             )
-            .filter(UserNotification.user_id == user_id)
-            .order_by(Notification.sent_on.desc())
-            .limit(limit)
+            .filter(UserNotification.user_id == user.user_id),
+            position,
+            limit + 1,
+        ).all()
+        shared = _newest_first(
+            db.session.query(Notification.sent_on, Notification.notification_id)
+            .join(
+                NotificationAudience,
+                NotificationAudience.notification_id
+                == Notification.notification_id,
+            )
+            .filter(audience_filter(user))
+            .distinct(),
+            position,
+            limit + 1,
+        ).all()
+
+        # Read audience notifications turn up in both halves
+        keys = sorted(set(direct) | set(shared), reverse=True)[: limit + 1]
+        if not keys:
+            return [], None
+
+        rows = (
+            db.session.query(
+                Notification,
+                func.coalesce(UserNotification.is_read, false()),
+            )
+            .outerjoin(
+                UserNotification,
+                and_(
+                    UserNotification.notification_id
+                    == Notification.notification_id,
+                    UserNotification.user_id == user.user_id,
+                ),
+            )
+            .filter(
+                Notification.notification_id.in_(
+                    [notification_id for _, notification_id in keys]
+                )
+            )
+            .order_by(
+                Notification.sent_on.desc(), Notification.notification_id.desc()
+            )
             .all()
         )
-        return notifications
+        items = [(n, bool(is_read)) for n, is_read in rows]
+        if len(items) > limit:
+            return items[:limit], encode_cursor(items[limit - 1][0])
+        return items, None
     except Exception as e:
         logger.error(f"Error getting user notifications: {e}")
-        return []
+        return [], None
+
+
+def repair_unread_counts(user_ids=None):
+    """
+    Recompute ``User.unread_count`` from the user_notifications table.
+
+    The counter only covers direct notifications; audience ones are
+    counted when the badge is read. Users are updated
+    UNREAD_REPAIR_CHUNK at a time, one UPDATE per chunk, with their
+    counts computed in SQL. Returns the number of users whose counter
+    changed.
+    """
+    actual = (
+        db.select(func.count(UserNotification.id))
+        .where(
+            UserNotification.user_id == User.user_id,
+            UserNotification.is_read.is_(False),
+        )
+        .scalar_subquery()
+    )
+
+    if user_ids is None:
+        user_ids = [
+            user_id
+            for (user_id,) in db.session.query(User.user_id).order_by(
+                User.user_id
+            )
+        ]
+    changed = 0
+    try:
+        for start in range(0, len(user_ids), UNREAD_REPAIR_CHUNK):
+            changed += db.session.execute(
+                db.update(User)
+                .where(
+                    User.user_id.in_(
+                        user_ids[start : start + UNREAD_REPAIR_CHUNK]
+                    ),
+                    User.unread_count != actual,
+                )
+                .values(unread_count=actual)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error repairing unread counts: {e}")
+        raise
+    logger.info(f"Repaired unread counts for {changed} users")
+    return changed
@@ -0,0 +1,422 @@
+# File: app/utils/payment_ledger.py
+
+import csv
+import io
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.orm import aliased, joinedload
+
+from app.extensions import db
+from app.models.club import Club
+from app.models.event import Event
+from app.models.payment import Payment, PaymentDailyTotal
+from app.models.student import Student
+from app.models.user import User
+
+LEDGER_PAGE_SIZE = 50
+LEDGER_STATUSES = ("Pending", "Completed", "Failed")
+LEDGER_PURPOSES = ("Membership", "Event")
+
+_CURSOR_FORMAT = "%Y%m%d%H%M%S%f"
+
+REVENUE_DEFAULT_DAYS = 30
+
+EXPORT_CHUNK_SIZE = 1000
+EXPORT_COLUMNS = [
+    "Payment ID",
+    "Date Created",
+    "Last Updated",
+    "Status",
+    "Purpose",
+    "Club",
+    "Event",
+    "Amount (KES)",
+    "Payment Method",
+    "Receipt Number",
+    "Student ID",
+    "First Name",
+    "Last Name",
+    "Email",
+]
+
+# Spreadsheet apps run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def parse_filters(args):
+    """
+    Read ledger filters from request args, dropping anything invalid.
+
+    Recognised keys: status, purpose, date_from / date_to (YYYY-MM-DD,
+    both inclusive), club_id and event_id.
+    """
+    filters = {}
+    if args.get("status") in LEDGER_STATUSES:
+        filters["status"] = args["status"]
+    if args.get("purpose") in LEDGER_PURPOSES:
+        filters["purpose"] = args["purpose"]
+    for key in ("date_from", "date_to"):
+        try:
+            filters[key] = datetime.strptime(args.get(key, ""), "%Y-%m-%d")
+        except ValueError:
+            pass
+    for key in ("club_id", "event_id"):
+        value = args.get(key, type=int)
+        if value:
+            filters[key] = value
+    return filters
+
+
+def apply_filters(query, filters):
+    """Add the WHERE clauses for ``filters`` to a query over Payment."""
+    if "status" in filters:
+        query = query.filter(Payment.status == filters["status"])
+    if "purpose" in filters:
+        query = query.filter(Payment.purpose == filters["purpose"])
+    if "date_from" in filters:
+        query = query.filter(Payment.dateCreated >= filters["date_from"])
+    if "date_to" in filters:
+        query = query.filter(
+            Payment.dateCreated < filters["date_to"] + timedelta(days=1)
+        )
+    if "event_id" in filters:
+        query = query.filter(
+            Payment.purpose == "Event",
+            Payment.relatedId == filters["event_id"],
+        )
+    elif "club_id" in filters:
+        # A club's payments are its memberships plus its events' tickets
+        club_events = db.select(Event.event_id).where(
+            Event.club_id == filters["club_id"]
+        )
+        query = query.filter(
+            or_(
+                and_(
+                    Payment.purpose == "Membership",
+                    Payment.relatedId == filters["club_id"],
+                ),
+                and_(
+                    Payment.purpose == "Event",
+                    Payment.relatedId.in_(club_events),
+                ),
+            )
+        )
+    return query
+
+
+def encode_cursor(payment):
+    """Opaque position just after ``payment`` in newest-first order."""
+    return (
+        f"{payment.dateCreated.strftime(_CURSOR_FORMAT)}-{payment.paymentId}"
+    )
+
+
+def decode_cursor(cursor):
+    """Return (dateCreated, paymentId) for a cursor, or None if invalid."""
+    try:
+        created, payment_id = cursor.split("-")
+        return datetime.strptime(created, _CURSOR_FORMAT), int(payment_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def ledger_page(filters, cursor=None, page_size=LEDGER_PAGE_SIZE):
+    """
+    One page of payments, newest first, with student and user loaded.
+
+    Uses keyset pagination on (dateCreated, paymentId), so every page
+    costs the same however deep it is. Returns (payments, next_cursor);
+    next_cursor is None on the last page.
+    """
+    query = apply_filters(
+        Payment.query.options(
+            joinedload(Payment.student).joinedload(Student.user)
+        ),
+        filters,
+    )
+
+    position = decode_cursor(cursor)
+    if position:
+        created, payment_id = position
+        query = query.filter(
+            or_(
+                Payment.dateCreated < created,
+                and_(
+                    Payment.dateCreated == created,
+                    Payment.paymentId < payment_id,
+                ),
+            )
+        )
+
+    rows = (
+        query.order_by(Payment.dateCreated.desc(), Payment.paymentId.desc())
+        .limit(page_size + 1)
+        .all()
+    )
+    if len(rows) > page_size:
+        return rows[:page_size], encode_cursor(rows[page_size - 1])
+    return rows, None
+
+
+def ledger_summary(filters):
+    """
+    Counts per status and completed revenue for the filtered ledger.
+
+    Computed with one grouped aggregate query rather than by loading rows.
+    """
+    query = db.session.query(
+        Payment.status,
+        func.count(Payment.paymentId),
+        func.coalesce(func.sum(Payment.amount), 0),
+    ).group_by(Payment.status)
+
+    summary = {status: 0 for status in LEDGER_STATUSES}
+    summary.update(total=0, revenue=0.0)
+    for status, count, amount in apply_filters(query, filters):
+        summary[status] = count
+        summary["total"] += count
+        if status == "Completed":
+            summary["revenue"] = float(amount)
+    return summary
+
+
+def export_rows(filters):
+    """
+    Yield one tuple per payment, in EXPORT_COLUMNS order, newest first.
+
+    Student, user, club and event names are joined in SQL and rows are
+    fetched EXPORT_CHUNK_SIZE at a time from a server-side cursor, so
+    memory use does not grow with the size of the export.
+    """
+    member_club = aliased(Club)
+    event_club = aliased(Club)
+    query = (
+        db.session.query(
+            Payment.paymentId,
+            Payment.dateCreated,
+            Payment.lastUpdated,
+            Payment.status,
+            Payment.purpose,
+            func.coalesce(member_club.name, event_club.name),
+            Event.title,
+            Payment.amount,
+            Payment.paymentMethod,
+            Payment.receiptNumber,
+            Payment.studentId,
+            User.first_name,
+            User.last_name,
+            User.email,
+        )
+        .join(Student, Student.student_id == Payment.studentId)
+        .join(User, User.user_id == Student.user_id)
+        .outerjoin(
+            member_club,
+            and_(
+                Payment.purpose == "Membership",
+                member_club.club_id == Payment.relatedId,
+            ),
+        )
+        .outerjoin(
+            Event,
+            and_(
+                Payment.purpose == "Event",
+                Event.event_id == Payment.relatedId,
+            ),
+        )
+        .outerjoin(event_club, event_club.club_id == Event.club_id)
+    )
+    query = apply_filters(query, filters).order_by(
+        Payment.dateCreated.desc(), Payment.paymentId.desc()
+    )
+    for row in query.yield_per(EXPORT_CHUNK_SIZE):
+        yield tuple(row)
+
+
+def _csv_cell(value):
+    """Quote user-supplied text a spreadsheet would read as a formula."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_csv(filters):
+    """Stream the export as CSV text, one chunk per EXPORT_CHUNK_SIZE rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+
+    for count, row in enumerate(export_rows(filters), 1):
+        writer.writerow([_csv_cell(value) for value in row])
+        if count % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def write_xlsx(filters, output):
+    """
+    Write the export as XLSX to ``output``, a path or binary file object.
+
+    Needs the optional xlsxwriter package; its constant_memory mode
+    flushes each row to disk, so memory stays flat like the CSV export.
+    Text is always written as a string cell, never as a formula.
+    Raises ImportError if xlsxwriter is not installed.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    try:
+        sheet = workbook.add_worksheet("Payments")
+        bold = workbook.add_format({"bold": True})
+        dates = workbook.add_format({"num_format": "yyyy-mm-dd hh:mm"})
+        money = workbook.add_format({"num_format": "#,##0.00"})
+        amount_column = EXPORT_COLUMNS.index("Amount (KES)")
+        sheet.write_row(0, 0, EXPORT_COLUMNS, bold)
+
+        for index, row in enumerate(export_rows(filters), 1):
+            for column, value in enumerate(row):
+                if isinstance(value, datetime):
+                    sheet.write_datetime(index, column, value, dates)
+                elif column == amount_column:
+                    sheet.write_number(index, column, value or 0, money)
+                elif isinstance(value, str):
+                    sheet.write_string(index, column, value)
+                else:
+                    sheet.write(index, column, value)
+    finally:
+        workbook.close()
+
+
+def _daily_totals_query(query, filters):
+    """Apply ledger filters to a query over PaymentDailyTotal."""
+    if "purpose" in filters:
+        query = query.filter(PaymentDailyTotal.purpose == filters["purpose"])
+    if "date_from" in filters:
+        query = query.filter(
+            PaymentDailyTotal.day >= filters["date_from"].date()
+        )
+    if "date_to" in filters:
+        query = query.filter(
+            PaymentDailyTotal.day <= filters["date_to"].date()
+        )
+    if "event_id" in filters:
+        query = query.filter(
+            PaymentDailyTotal.purpose == "Event",
+            PaymentDailyTotal.relatedId == filters["event_id"],
+        )
+    elif "club_id" in filters:
+        club_events = db.select(Event.event_id).where(
+            Event.club_id == filters["club_id"]
+        )
+        query = query.filter(
+            or_(
+                and_(
+                    PaymentDailyTotal.purpose == "Membership",
+                    PaymentDailyTotal.relatedId == filters["club_id"],
+                ),
+                and_(
+                    PaymentDailyTotal.purpose == "Event",
+                    PaymentDailyTotal.relatedId.in_(club_events),
+                ),
+            )
+        )
+    return query
+
+
+def revenue_report(filters):
+    """
+    Revenue figures for a date range, read from payment_daily_totals.
+
+    Every query scans at most one row per day, purpose, club/event and
+    status, however many payments there are. ``date_from`` / ``date_to``
+    default to the last REVENUE_DEFAULT_DAYS days.
+    """
+    filters = dict(filters)
+    today = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+    filters.setdefault("date_to", today)
+    filters.setdefault(
+        "date_from",
+        filters["date_to"] - timedelta(days=REVENUE_DEFAULT_DAYS - 1),
+    )
+    count = func.sum(PaymentDailyTotal.paymentCount)
+    amount = func.sum(PaymentDailyTotal.amount)
+
+    totals = {
+        status: {"count": 0, "amount": 0.0} for status in LEDGER_STATUSES
+    }
+    by_status = _daily_totals_query(
+        db.session.query(PaymentDailyTotal.status, count, amount), filters
+    ).group_by(PaymentDailyTotal.status)
+    for status, status_count, status_amount in by_status:
+        totals[status] = {
+            "count": int(status_count or 0),
+            "amount": float(status_amount or 0),
+        }
+
+    completed = PaymentDailyTotal.status == "Completed"
+    per_day = {
+        day: (int(day_count or 0), float(day_amount or 0))
+        for day, day_count, day_amount in _daily_totals_query(
+            db.session.query(PaymentDailyTotal.day, count, amount), filters
+        )
+        .filter(completed)
+        .group_by(PaymentDailyTotal.day)
+    }
+    daily = []
+    day = filters["date_from"].date()
+    while day <= filters["date_to"].date():
+        day_count, day_amount = per_day.get(day, (0, 0.0))
+        daily.append(
+            {"date": day.isoformat(), "count": day_count, "amount": day_amount}
+        )
+        day += timedelta(days=1)
+
+    targets = (
+        _daily_totals_query(
+            db.session.query(
+                PaymentDailyTotal.purpose,
+                PaymentDailyTotal.relatedId,
+                count,
+                amount,
+            ),
+            filters,
+        )
+        .filter(completed)
+        .group_by(PaymentDailyTotal.purpose, PaymentDailyTotal.relatedId)
+        .order_by(amount.desc())
+        .all()
+    )
+    club_ids = [t.relatedId for t in targets if t.purpose == "Membership"]
+    event_ids = [t.relatedId for t in targets if t.purpose == "Event"]
+    club_names = dict(
+        db.session.query(Club.club_id, Club.name).filter(
+            Club.club_id.in_(club_ids)
+        )
+    )
+    event_names = dict(
+        db.session.query(Event.event_id, Event.title).filter(
+            Event.event_id.in_(event_ids)
+        )
+    )
+    by_target = [
+        {
+            "purpose": purpose,
+            "related_id": related_id,
+            "name": (
+                club_names if purpose == "Membership" else event_names
+            ).get(related_id, f"#{related_id}"),
+            "count": int(target_count or 0),
+            "amount": float(target_amount or 0),
+        }
+        for purpose, related_id, target_count, target_amount in targets
+    ]
+
+    return {
+        "date_from": filters["date_from"].date().isoformat(),
+        "date_to": filters["date_to"].date().isoformat(),
+        "totals": totals,
+        "daily": daily,
+        "by_target": by_target,
+    }
@@ -0,0 +1,706 @@
+# File: app/utils/payments.py
+
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from app.extensions import db
+from app.models.club import Club
+from app.models.event import Event
+from app.models.student import Student
+from app.models.payment import (
+    Payment,
+    PaymentInitiationJob,
+    PesapalInterimPayment,
+    PesapalIpnInbox,
+    PesapalIpnRegistration,
+)
+from app.utils import pesapal
+from app.utils.background import BackgroundPool, RateLimiter
+from app.utils.pubsub import broker
+
+logger = logging.getLogger(__name__)
+
+# base_url -> notification_id, so checkout does not even need a DB read
+_ipn_ids = {}
+_ipn_lock = threading.Lock()
+
+# Workers that submit Pesapal orders off the request thread
+initiation_pool = BackgroundPool("payment-initiation", "PAYMENT_WORKERS")
+
+# Workers that process IPNs after the endpoint has acknowledged them
+ipn_pool = BackgroundPool("ipn-worker", "PAYMENT_IPN_WORKERS", 2)
+
+GATEWAY_BUSY_MESSAGE = (
+    "The payment service is busy right now. Please try again shortly."
+)
+
+TERMINAL_INTERIM_STATUSES = ("COMPLETED", "FAILED")
+
+# Outcomes after which an IPN needs no further work; a pending order is
+# retried like a failure until Pesapal reports a final status
+IPN_DONE_OUTCOMES = ("completed", "failed", "already_final")
+IPN_RETRY_BASE = 15  # seconds, doubled per attempt
+IPN_STUCK_AFTER = timedelta(minutes=5)
+
+# Initiation jobs untouched for this long were lost with their process
+INITIATION_STUCK_AFTER = timedelta(minutes=5)
+
+# Callback and IPN for one order usually land seconds apart, so a final
+# GetTransactionStatus answer is kept briefly and shared between them.
+# Anything else may change at any moment and is always fetched afresh.
+STATUS_CACHE_TTL = 10
+FINAL_GATEWAY_STATUSES = ("Completed", "Failed", "Reversed")
+_status_cache = {}
+_status_cache_lock = threading.Lock()
+
+# Receipts of Completed payments rarely change, so the most recent ones
+# are kept in memory instead of being rebuilt on every success page view.
+# Entries are keyed on the row's status and lastUpdated, so a change made
+# by any process is a miss everywhere without invalidation.
+RECEIPT_CACHE_SIZE = 1024
+_receipt_cache = OrderedDict()
+_receipt_cache_lock = threading.Lock()
+
+
+def ipn_url_for(base_url):
+    """Build the IPN URL Pesapal should call for a site base URL."""
+    return f"{base_url.rstrip('/')}/payments/pesapal/ipn"
+
+
+def register_ipn(base_url, force=False):
+    """
+    Register the IPN URL for a base URL with Pesapal and store the ipn_id.
+
+    Returns the stored registration, or None if Pesapal refused it.
+    Unless ``force`` is set, an existing registration is reused as-is.
+    """
+    base_url = base_url.rstrip("/")
+    with _ipn_lock:
+        registration = PesapalIpnRegistration.get_for(base_url)
+        if registration and not force:
+            _ipn_ids[base_url] = registration.notificationId
+            return registration
+
+        token_response = pesapal.get_access_token()
+        access_token = token_response["token"]
+        if not access_token:
+            logger.error(
+                f"Cannot register IPN, no access token: {token_response['error']}"
+            )
+            return None
+
+        ipn_url = ipn_url_for(base_url)
+        notification_response = pesapal.get_notification_id(
+            access_token, ipn_url
+        )
+        notification_id = notification_response["ipn_id"]
+        if not notification_id:
+            logger.error(
+                f"Failed to register IPN {ipn_url}: {notification_response['error']}"
+            )
+            return None
+
+        registration = PesapalIpnRegistration.save(
+            base_url, ipn_url, notification_id
+        )
+        _ipn_ids[base_url] = notification_id
+        logger.info(f"Registered Pesapal IPN {ipn_url} as {notification_id}")
+        return registration
+
+
+def get_ipn_id(base_url):
+    """
+    Get the stored notification_id for a base URL.
+
+    Falls back to registering once if nothing has been stored yet.
+    """
+    base_url = base_url.rstrip("/")
+    notification_id = _ipn_ids.get(base_url)
+    if notification_id:
+        return notification_id
+
+    registration = PesapalIpnRegistration.get_for(base_url)
+    if registration is None:
+        logger.warning(
+            f"No stored IPN registration for {base_url}, registering now"
+        )
+        registration = register_ipn(base_url)
+    if registration is None:
+        return None
+
+    _ipn_ids[base_url] = registration.notificationId
+    return registration.notificationId
+
+
+def derive_idempotency_key(purpose, related_id, amount):
+    """
+    Key for clients that send no Idempotency-Key header: one per purpose,
+    target and amount (keys are scoped per student by the table). The
+    caller decides whether a stored attempt under it is recent enough to
+    count as the same checkout.
+    """
+    raw = f"{purpose}:{related_id}:{float(amount):.2f}"
+    return "auto-" + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:40]
+
+
+def queue_initiation(payment, details):
+    """
+    Stage the Pesapal order submission for a newly created payment.
+
+    ``details`` carries the checkout form fields (base_url, customer_name,
+    phone_number, email_address, description). The job is only flushed,
+    so it commits with the payment; call start_initiation afterwards.
+    """
+    return PaymentInitiationJob.create(
+        {
+            "paymentId": payment.paymentId,
+            "baseUrl": details["base_url"],
+            "customerName": details["customer_name"],
+            "phoneNumber": details["phone_number"],
+            "emailAddress": details.get("email_address"),
+            "description": details["description"],
+        },
+        commit=False,
+    )
+
+
+def start_initiation(job_id):
+    """
+    Hand a committed job to the initiation pool. With
+    PAYMENT_ASYNC_INITIATION off the job runs before this returns.
+    """
+    if current_app.config.get("PAYMENT_ASYNC_INITIATION", True):
+        initiation_pool.submit(run_initiation_job, job_id)
+    else:
+        run_initiation_job(job_id)
+
+
+def run_initiation_job(job_id):
+    """Submit the Pesapal order for a queued job and store the iframe URL."""
+    job = PaymentInitiationJob.claim(job_id)
+    if job is None:
+        return None
+
+    payment = job.payment
+    try:
+        token_response = pesapal.get_access_token()
+        access_token = token_response["token"]
+        if not access_token:
+            raise Exception("Failed to get access token")
+
+        notification_id = get_ipn_id(job.baseUrl)
+        if not notification_id:
+            raise Exception("Failed to register IPN")
+
+        merchant_reference = (
+            f"PAYMENT_{payment.paymentId}_{int(datetime.utcnow().timestamp())}"
+        )
+        order_details = {
+            "amount": payment.amount,
+            "customer_name": job.customerName,
+            "phone_number": job.phoneNumber,
+            "email_address": job.emailAddress or "",
+            "description": job.description,
+            "merchant_reference": merchant_reference,
+            "notification_id": notification_id,
+        }
+        order_response = pesapal.get_merchant_order_url(
+            order_details, access_token, job.baseUrl
+        )
+        if not order_response.get("order_tracking_id"):
+            raise Exception("Failed to create Pesapal order")
+
+        # Interim record and job state land in one commit
+        db.session.add(
+            PesapalInterimPayment(
+                paymentId=payment.paymentId,
+                orderTrackingId=order_response["order_tracking_id"],
+                merchantReference=order_response["merchant_reference"],
+                iframeSrc=order_response["redirect_url"],
+                status="SAVED",
+            )
+        )
+        job.status = "SUBMITTED"
+        job.error = None
+        db.session.commit()
+        logger.info(f"Payment {payment.paymentId} submitted to Pesapal")
+        publish_payment_status(payment)
+        return job
+
+    except Exception as e:
+        db.session.rollback()
+        error = (
+            pesapal.CIRCUIT_OPEN_ERROR if pesapal.breaker.is_open() else str(e)
+        )
+        logger.error(f"Payment {payment.paymentId} initiation failed: {error}")
+        job.status = "FAILED"
+        job.error = error[:255]
+        payment.updateStatus("Failed", commit=False)
+        db.session.commit()
+        publish_payment_status(payment)
+        return job
+
+
+def resume_initiation_jobs(limit=100):
+    """
+    Run initiation jobs a restarted or crashed process left behind.
+
+    Jobs stuck RUNNING go back in the queue, then QUEUED jobs idle for
+    INITIATION_STUCK_AFTER are run on this thread; claiming a job is
+    atomic, so a job is never submitted twice. Returns how many ran.
+    """
+    stale = datetime.utcnow() - INITIATION_STUCK_AFTER
+    PaymentInitiationJob.query.filter(
+        PaymentInitiationJob.status == "RUNNING",
+        PaymentInitiationJob.lastUpdated < stale,
+    ).update(
+        # Keep lastUpdated so they are due straight away
+        {
+            "status": "QUEUED",
+            "lastUpdated": PaymentInitiationJob.lastUpdated,
+        },
+        synchronize_session=False,
+    )
+    db.session.commit()
+
+    due = (
+        db.session.query(PaymentInitiationJob.jobId)
+        .filter(
+            PaymentInitiationJob.status == "QUEUED",
+            PaymentInitiationJob.lastUpdated < stale,
+        )
+        .order_by(PaymentInitiationJob.jobId)
+        .limit(limit)
+        .all()
+    )
+    resumed = 0
+    for (job_id,) in due:
+        if run_initiation_job(job_id) is not None:
+            resumed += 1
+    if resumed:
+        logger.info(f"Resumed {resumed} stale payment initiation jobs")
+    return resumed
+
+
+def payment_status_payload(payment):
+    """Status fields the checkout pages wait for."""
+    interim_payment = PesapalInterimPayment.query.filter_by(
+        paymentId=payment.paymentId
+    ).first()
+    job = PaymentInitiationJob.query.filter_by(
+        paymentId=payment.paymentId
+    ).first()
+
+    error = None
+    if job and job.status == "FAILED":
+        error = (
+            GATEWAY_BUSY_MESSAGE
+            if job.error == pesapal.CIRCUIT_OPEN_ERROR
+            else "We could not start your payment. Please try again."
+        )
+
+    return {
+        "payment_id": payment.paymentId,
+        "status": payment.status,
+        "amount": payment.amount,
+        "purpose": payment.purpose,
+        "initiation": job.status if job else None,
+        "iframe_src": interim_payment.iframeSrc if interim_payment else None,
+        "error": error,
+    }
+
+
+def payment_channel(payment_id):
+    """Pub/sub channel carrying status changes for one payment."""
+    return f"payment:{payment_id}"
+
+
+def publish_payment_status(payment):
+    """
+    Push the payment's current status to anyone watching it.
+
+    Call after the change is committed. Failures are logged, never
+    raised: watchers fall back to polling.
+    """
+    try:
+        broker.publish(
+            payment_channel(payment.paymentId),
+            payment_status_payload(payment),
+        )
+    except Exception as e:
+        logger.error(
+            f"Could not publish status of payment {payment.paymentId}: {e}"
+        )
+
+
+def get_status_cached(order_tracking_id):
+    """GetTransactionStatus, reusing a final answer from the last seconds."""
+    now = time.monotonic()
+    with _status_cache_lock:
+        cached = _status_cache.get(order_tracking_id)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    token_response = pesapal.get_access_token()
+    access_token = token_response["token"]
+    if not access_token:
+        return {"error": token_response["error"] or "No access token"}
+
+    status_response = pesapal.get_transaction_status(
+        order_tracking_id, access_token
+    )
+    gateway_status = status_response.get("payment_status_description")
+    if gateway_status in FINAL_GATEWAY_STATUSES:
+        with _status_cache_lock:
+            # Drop expired entries so the cache stays small
+            for key in [k for k, v in _status_cache.items() if v[0] <= now]:
+                del _status_cache[key]
+            _status_cache[order_tracking_id] = (
+                now + STATUS_CACHE_TTL,
+                status_response,
+            )
+    return status_response
+
+
+def apply_transaction_status(interim, status_response):
+    """
+    Stage a Pesapal status on an interim payment and its Payment.
+
+    Nothing is committed. Returns "completed", "failed" or "pending".
+    """
+    payment_status = status_response.get("payment_status_description")
+    if payment_status == "Completed":
+        interim.payment.updateStatus(
+            status="Completed",
+            receipt_number=status_response.get("confirmation_code"),
+            payment_method=f"Pesapal - {status_response.get('payment_method', 'Unknown')}",
+            commit=False,
+        )
+        interim.updateStatus("COMPLETED", commit=False)
+        return "completed"
+    if payment_status == "Failed":
+        interim.payment.updateStatus(status="Failed", commit=False)
+        interim.updateStatus("FAILED", commit=False)
+        return "failed"
+    return "pending"
+
+
+def process_transaction_update(order_tracking_id):
+    """
+    Bring a payment up to date with Pesapal, once per order.
+
+    Used by both the callback and the IPN. Orders whose interim row is
+    already COMPLETED/FAILED are answered from the DB without calling
+    Pesapal. Otherwise the status is fetched with no lock held (a final
+    one may come from the short cache), then the interim row is re-read
+    under a row lock and both rows are committed together.
+
+    Returns a dict with ``outcome`` (one of "not_found", "already_final",
+    "completed", "failed", "pending", "unavailable", "error") and the
+    ``payment`` when the order is known.
+    """
+    interim = PesapalInterimPayment.query.filter_by(
+        orderTrackingId=order_tracking_id
+    ).first()
+    if interim is None:
+        return {"outcome": "not_found", "payment": None}
+    if interim.status in TERMINAL_INTERIM_STATUSES:
+        return {"outcome": "already_final", "payment": interim.payment}
+    # Hold no transaction open across the HTTP call
+    db.session.commit()
+
+    status_response = get_status_cached(order_tracking_id)
+    if pesapal.is_unavailable(status_response):
+        return {"outcome": "unavailable", "payment": interim.payment}
+    if status_response.get("error"):
+        logger.error(
+            f"Status lookup failed for {order_tracking_id}: {status_response['error']}"
+        )
+        return {"outcome": "error", "payment": interim.payment}
+
+    return _apply_locked(order_tracking_id, status_response)
+
+
+def _apply_locked(order_tracking_id, status_response):
+    """
+    Apply a fetched Pesapal status to the order's rows and commit.
+
+    The interim row is re-read under a row lock (SELECT ... FOR UPDATE),
+    so a status that another thread or worker process has already made
+    final meanwhile is left alone.
+    """
+    interim = (
+        PesapalInterimPayment.query.filter_by(
+            orderTrackingId=order_tracking_id
+        )
+        .with_for_update()
+        .populate_existing()
+        .one()
+    )
+    if interim.status in TERMINAL_INTERIM_STATUSES:
+        db.session.commit()
+        return {"outcome": "already_final", "payment": interim.payment}
+
+    outcome = apply_transaction_status(interim, status_response)
+    db.session.commit()
+    if outcome != "pending":
+        publish_payment_status(interim.payment)
+    return {"outcome": outcome, "payment": interim.payment}
+
+
+def accept_ipn(order_tracking_id, merchant_reference, notification_type):
+    """Persist an IPN in the inbox and hand it to an IPN worker."""
+    entry = PesapalIpnInbox.create(
+        {
+            "orderTrackingId": order_tracking_id,
+            "merchantReference": merchant_reference,
+            "notificationType": notification_type,
+        }
+    )
+    ipn_pool.submit(process_ipn_entry, entry.inboxId)
+    return entry
+
+
+def process_ipn_entry(inbox_id):
+    """
+    Process one inbox entry. Failures are retried with exponential
+    backoff until PAYMENT_IPN_MAX_ATTEMPTS, then dead-lettered.
+
+    Returns the entry's new status, or None if another worker had it.
+    """
+    entry = PesapalIpnInbox.claim(inbox_id)
+    if entry is None:
+        return None
+    return _process_claimed_ipn(entry)
+
+
+def _process_claimed_ipn(entry):
+    """Run the status update for an entry already in PROCESSING."""
+    try:
+        outcome = process_transaction_update(entry.orderTrackingId)[
+            "outcome"
+        ]
+        error = outcome
+    except Exception as e:
+        db.session.rollback()
+        outcome = "error"
+        error = str(e)
+
+    if outcome in IPN_DONE_OUTCOMES:
+        entry.status = "DONE"
+        entry.lastError = None
+    else:
+        max_attempts = current_app.config.get("PAYMENT_IPN_MAX_ATTEMPTS", 8)
+        entry.lastError = error[:255]
+        if entry.attempts >= max_attempts:
+            entry.status = "DEAD"
+            logger.error(
+                f"IPN {entry.inboxId} for {entry.orderTrackingId} dead-lettered: {error}"
+            )
+        else:
+            delay = IPN_RETRY_BASE * 2 ** (entry.attempts - 1)
+            entry.status = "RECEIVED"
+            entry.nextAttemptAt = datetime.utcnow() + timedelta(seconds=delay)
+    db.session.commit()
+    return entry.status
+
+
+def drain_ipn_inbox(limit=100):
+    """
+    Process inbox entries that are due. Returns counts by new status.
+
+    Every process runs this periodically; the batch is claimed under
+    row locks, so concurrent drains never work on the same entry.
+    """
+    # Entries left PROCESSING by a worker that died go back in the queue
+    PesapalIpnInbox.query.filter(
+        PesapalIpnInbox.status == "PROCESSING",
+        PesapalIpnInbox.lastUpdated < datetime.utcnow() - IPN_STUCK_AFTER,
+    ).update({"status": "RECEIVED"}, synchronize_session=False)
+    db.session.commit()
+
+    counts = {}
+    for entry in PesapalIpnInbox.claim_due(limit):
+        status = _process_claimed_ipn(entry)
+        counts[status] = counts.get(status, 0) + 1
+    return counts
+
+
+def reconcile_pending(older_than=15, limit=500, workers=4, rate=5.0):
+    """
+    Ask Pesapal about interim payments still SAVED after ``older_than``
+    minutes and apply any final status they have reached. Initiation jobs
+    left behind by a dead process are resumed first.
+
+    Status lookups run concurrently on ``workers`` threads, started no
+    faster than ``rate`` per second. Each answer is applied like a
+    callback's: under a row lock, skipping orders that became final
+    meanwhile, and published once committed. Returns a
+    summary dict.
+    """
+    started = time.monotonic()
+    summary = {
+        "checked": 0,
+        "completed": 0,
+        "failed": 0,
+        "still_pending": 0,
+        "already_final": 0,
+        "errors": 0,
+    }
+    summary["initiations_resumed"] = resume_initiation_jobs()
+
+    cutoff = datetime.utcnow() - timedelta(minutes=older_than)
+    tracking_ids = [
+        tracking_id
+        for (tracking_id,) in db.session.query(
+            PesapalInterimPayment.orderTrackingId
+        )
+        .filter(
+            PesapalInterimPayment.status == "SAVED",
+            PesapalInterimPayment.dateCreated < cutoff,
+        )
+        .order_by(PesapalInterimPayment.dateCreated)
+        .limit(limit)
+    ]
+    # Nothing is held open while the lookups run
+    db.session.commit()
+    if not tracking_ids:
+        summary["elapsed_seconds"] = round(time.monotonic() - started, 2)
+        return summary
+
+    token_response = pesapal.get_access_token()
+    access_token = token_response["token"]
+    if not access_token:
+        raise RuntimeError(
+            f"Cannot reconcile, no access token: {token_response['error']}"
+        )
+
+    limiter = RateLimiter(rate)
+
+    def lookup(order_tracking_id):
+        limiter.wait()
+        return pesapal.get_transaction_status(order_tracking_id, access_token)
+
+    # Only HTTP happens on the pool threads; the session stays on this one
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lookup, tracking_ids)
+
+        for tracking_id, status_response in zip(tracking_ids, results):
+            summary["checked"] += 1
+            if status_response.get("error"):
+                summary["errors"] += 1
+                continue
+
+            try:
+                outcome = _apply_locked(tracking_id, status_response)[
+                    "outcome"
+                ]
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Could not reconcile {tracking_id}: {e}")
+                summary["errors"] += 1
+                continue
+            summary["still_pending" if outcome == "pending" else outcome] += 1
+
+    summary["elapsed_seconds"] = round(time.monotonic() - started, 2)
+    logger.info(f"Payment reconciliation: {summary}")
+    return summary
+
+
+def reconcile_from_config():
+    """Run reconcile_pending with the PAYMENT_RECONCILE_* settings."""
+    config = current_app.config
+    return reconcile_pending(
+        older_than=config.get("PAYMENT_RECONCILE_AFTER", 15),
+        workers=config.get("PAYMENT_RECONCILE_WORKERS", 4),
+        rate=config.get("PAYMENT_RECONCILE_RATE", 5.0),
+    )
+
+
+def build_receipt(payment):
+    """
+    Receipt view-model for a payment.
+
+    The club or event it paid for is resolved with a single keyed query.
+    """
+    if payment.purpose == "Membership":
+        name = (
+            db.session.query(Club.name)
+            .filter(Club.club_id == payment.relatedId)
+            .scalar()
+        )
+        label = f"Club Membership - {name or 'Unknown Club'}"
+    elif payment.purpose == "Event":
+        name = (
+            db.session.query(Event.title)
+            .filter(Event.event_id == payment.relatedId)
+            .scalar()
+        )
+        label = f"Event Registration - {name or 'Unknown Event'}"
+    else:
+        name = None
+        label = payment.purpose
+
+    user = payment.student.user
+    return {
+        "payment_id": payment.paymentId,
+        "student_id": payment.studentId,
+        "student_name": f"{user.first_name} {user.last_name}",
+        "status": payment.status,
+        "purpose": payment.purpose,
+        "purpose_label": label,
+        "related_id": payment.relatedId,
+        "related_name": name,
+        "amount": payment.amount,
+        "receipt_number": payment.receiptNumber,
+        "payment_method": payment.paymentMethod,
+        "paid_on": payment.lastUpdated,
+    }
+
+
+def get_receipt(payment_id):
+    """
+    Receipt view-model for a payment ID, or None if there is no such
+    payment. Receipts of Completed payments are cached; checking the
+    cache costs one primary key read.
+    """
+    version = (
+        db.session.query(Payment.status, Payment.lastUpdated)
+        .filter(Payment.paymentId == payment_id)
+        .first()
+    )
+    if version is None:
+        return None
+    key = (payment_id, *version)
+    with _receipt_cache_lock:
+        receipt = _receipt_cache.get(key)
+        if receipt is not None:
+            _receipt_cache.move_to_end(key)
+            return receipt
+
+    payment = (
+        Payment.query.options(
+            joinedload(Payment.student).joinedload(Student.user)
+        )
+        .filter_by(paymentId=payment_id)
+        .first()
+    )
+    if payment is None:
+        return None
+
+    receipt = build_receipt(payment)
+    if payment.status == "Completed":
+        key = (payment_id, payment.status, payment.lastUpdated)
+        with _receipt_cache_lock:
+            _receipt_cache[key] = receipt
+            if len(_receipt_cache) > RECEIPT_CACHE_SIZE:
+                _receipt_cache.popitem(last=False)
+    return receipt
@@ -1,13 +1,25 @@
 # File: app/utils/pesapal.py
 
 import os
+import time
+import random
+import threading
 import requests
 import logging
+from collections import deque
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+
+from app.utils.metrics import EndpointMetrics
+from app.utils.token_cache import TokenCache, store_from_env
 
 logger = logging.getLogger(__name__)
 
 # Pesapal API endpoints
-PESAPAL_BASE_URL = "https://cybqa.pesapal.com/pesapalv3/api"  # Sandbox URL
+# Sandbox by default; point at production or a local stand-in via env
+PESAPAL_BASE_URL = os.getenv(
+    "PESAPAL_BASE_URL", "https://cybqa.pesapal.com/pesapalv3/api"
+).rstrip("/")
 TOKEN_ENDPOINT = f"{PESAPAL_BASE_URL}/Auth/RequestToken"
 REGISTER_IPN_ENDPOINT = f"{PESAPAL_BASE_URL}/URLSetup/RegisterIPN"
 SUBMIT_ORDER_ENDPOINT = f"{PESAPAL_BASE_URL}/Transactions/SubmitOrderRequest"
@@ -15,6 +27,316 @@ TRANSACTION_STATUS_ENDPOINT = (
     f"{PESAPAL_BASE_URL}/Transactions/GetTransactionStatus"
 )
 
+# Pesapal tokens live for five minutes when no expiryDate is returned
+TOKEN_DEFAULT_TTL = 5 * 60
+
+# Gateway responses worth retrying for idempotent calls
+RETRY_STATUS_CODES = {429, 502, 503, 504}
+
+# Error value returned by the helpers below while the breaker is open
+CIRCUIT_OPEN_ERROR = "circuit_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Pesapal while the breaker is open."""
+
+    def __init__(self, retry_after=0):
+        super().__init__(CIRCUIT_OPEN_ERROR)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stop calling a failing gateway for a while instead of queueing on it.
+
+    Closed: calls flow and outcomes are kept in a rolling window. Once at
+    least ``min_calls`` are recorded and the failure rate reaches
+    ``failure_rate``, the breaker opens. Open: calls are refused until
+    ``cooldown`` seconds have passed. Half-open: up to
+    ``half_open_calls`` trial calls are let through; a success closes the
+    breaker again, a failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_rate=0.5,
+        window_size=20,
+        min_calls=5,
+        cooldown=30,
+        half_open_calls=1,
+    ):
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._outcomes = deque(maxlen=window_size)
+        self._opened_at = 0.0
+        self._trial_calls = 0
+        self._times_opened = 0
+        self._rejected = 0
+
+    def _current_state(self):
+        # Caller holds the lock
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.cooldown
+        ):
+            self._state = self.HALF_OPEN
+            self._trial_calls = 0
+        return self._state
+
+    def _retry_after(self):
+        remaining = self.cooldown - (time.monotonic() - self._opened_at)
+        return max(int(remaining + 0.999), 1)
+
+    def _trip(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self._times_opened += 1
+        logger.error(f"Pesapal circuit breaker opened for {self.cooldown}s")
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def is_open(self):
+        """True while calls would be refused outright."""
+        return self.state == self.OPEN
+
+    def retry_after(self):
+        """Seconds until the next trial call is allowed (0 if closed)."""
+        with self._lock:
+            if self._current_state() != self.OPEN:
+                return 0
+            return self._retry_after()
+
+    def acquire(self):
+        """Reserve a call, or raise CircuitOpenError."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN:
+                self._rejected += 1
+                raise CircuitOpenError(self._retry_after())
+            if state == self.HALF_OPEN:
+                if self._trial_calls >= self.half_open_calls:
+                    self._rejected += 1
+                    raise CircuitOpenError(1)
+                self._trial_calls += 1
+
+    def record(self, ok):
+        """Record the outcome of a call made after acquire()."""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if ok:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    logger.info("Pesapal circuit breaker closed")
+                else:
+                    self._trip()
+                return
+            if self._state == self.OPEN:
+                return
+
+            self._outcomes.append(ok)
+            calls = len(self._outcomes)
+            failures = calls - sum(self._outcomes)
+            if (
+                calls >= self.min_calls
+                and failures / calls >= self.failure_rate
+            ):
+                self._trip()
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state()
+            calls = len(self._outcomes)
+            return {
+                "state": state,
+                "window_calls": calls,
+                "window_failures": calls - sum(self._outcomes),
+                "failure_rate_threshold": self.failure_rate,
+                "cooldown": self.cooldown,
+                "retry_after": (
+                    self._retry_after() if state == self.OPEN else 0
+                ),
+                "times_opened": self._times_opened,
+                "rejected_calls": self._rejected,
+            }
+
+
+class PesapalClient:
+    """
+    Shared keep-alive HTTP client for the Pesapal API.
+
+    All calls go through one ``requests.Session`` with a bounded
+    connection pool, so TCP/TLS handshakes are paid once per connection
+    rather than once per call. Idempotent calls are retried with jittered
+    exponential backoff; failed connects are retried for every call since
+    nothing reached the gateway. Every call passes through ``breaker``.
+
+    A 401 to a call carrying a bearer token is retried once with the
+    token returned by ``reauthenticate(rejected_token)``, if set.
+    """
+
+    def __init__(
+        self,
+        pool_size=10,
+        connect_timeout=3.05,
+        read_timeout=20,
+        max_retries=2,
+        backoff_base=0.25,
+        backoff_cap=4.0,
+        breaker=None,
+    ):
+        self.breaker = breaker or CircuitBreaker()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.metrics = EndpointMetrics()
+        self.reauthenticate = None
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=0,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+            }
+        )
+
+    def _backoff(self, attempt):
+        # "Full jitter": sleep a random time up to the exponential cap
+        ceiling = min(self.backoff_cap, self.backoff_base * (2**attempt))
+        time.sleep(random.uniform(0, ceiling))
+
+    def request(self, method, url, endpoint, idempotent=False, **kwargs):
+        """Send a request through the circuit breaker."""
+        self.breaker.acquire()
+        ok = False
+        try:
+            response = self._send(method, url, endpoint, idempotent, **kwargs)
+            if response.status_code == 401:
+                response = self._retry_unauthorized(
+                    response, method, url, endpoint, idempotent, **kwargs
+                )
+            ok = (
+                response.status_code < 500
+                and response.status_code not in RETRY_STATUS_CODES
+            )
+            return response
+        finally:
+            self.breaker.record(ok)
+
+    def _retry_unauthorized(
+        self, response, method, url, endpoint, idempotent, **kwargs
+    ):
+        """Repeat a call once with a fresh token after a 401."""
+        headers = kwargs.get("headers") or {}
+        rejected = headers.get("Authorization", "")
+        if not self.reauthenticate or not rejected.startswith("Bearer "):
+            return response
+
+        token = self.reauthenticate(rejected[len("Bearer ") :])
+        if not token:
+            return response
+        logger.warning(f"Pesapal rejected the access token for {endpoint}")
+        kwargs["headers"] = {**headers, "Authorization": f"Bearer {token}"}
+        return self._send(method, url, endpoint, idempotent, **kwargs)
+
+    def _send(self, method, url, endpoint, idempotent, **kwargs):
+        """Send a request, retrying where it is safe to do so."""
+        kwargs.setdefault("timeout", self.timeout)
+        attempts = self.max_retries + 1
+
+        for attempt in range(attempts):
+            last_attempt = attempt == attempts - 1
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectTimeout:
+                self.metrics.record(
+                    endpoint, time.perf_counter() - start, ok=False
+                )
+                if last_attempt:
+                    raise
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ):
+                self.metrics.record(
+                    endpoint, time.perf_counter() - start, ok=False
+                )
+                if last_attempt or not idempotent:
+                    raise
+            else:
+                retry = (
+                    idempotent
+                    and not last_attempt
+                    and response.status_code in RETRY_STATUS_CODES
+                )
+                self.metrics.record(
+                    endpoint,
+                    time.perf_counter() - start,
+                    ok=response.status_code < 400,
+                    retried=retry,
+                )
+                if not retry:
+                    return response
+
+            logger.warning(
+                f"Retrying Pesapal {endpoint} (attempt {attempt + 2}/{attempts})"
+            )
+            self._backoff(attempt)
+
+    def get(self, url, endpoint, **kwargs):
+        return self.request("GET", url, endpoint, idempotent=True, **kwargs)
+
+    def post(self, url, endpoint, idempotent=False, **kwargs):
+        return self.request(
+            "POST", url, endpoint, idempotent=idempotent, **kwargs
+        )
+
+
+client = PesapalClient(
+    pool_size=int(os.getenv("PESAPAL_POOL_SIZE", 10)),
+    connect_timeout=float(os.getenv("PESAPAL_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.getenv("PESAPAL_READ_TIMEOUT", 20)),
+    max_retries=int(os.getenv("PESAPAL_MAX_RETRIES", 2)),
+    breaker=CircuitBreaker(
+        failure_rate=float(os.getenv("PESAPAL_BREAKER_FAILURE_RATE", 0.5)),
+        window_size=int(os.getenv("PESAPAL_BREAKER_WINDOW", 20)),
+        min_calls=int(os.getenv("PESAPAL_BREAKER_MIN_CALLS", 5)),
+        cooldown=int(os.getenv("PESAPAL_BREAKER_COOLDOWN", 30)),
+    ),
+)
+breaker = client.breaker
+
+
+def is_unavailable(response):
+    """True if a helper result failed because the breaker is open."""
+    return response.get("error") == CIRCUIT_OPEN_ERROR
+
+
+def get_endpoint_metrics():
+    """Latency and error counters per Pesapal endpoint."""
+    return client.metrics.snapshot()
+
 
 def split_full_name(full_name):
     """Split full name into first, middle, and last names."""
@@ -34,8 +356,28 @@ def split_full_name(full_name):
     return first_name, middle_name, last_name
 
 
-def get_access_token():
-    """Get Pesapal access token."""
+def _parse_expiry(expiry_date):
+    """Turn Pesapal's expiryDate string into a unix timestamp."""
+    if not expiry_date:
+        return None
+    try:
+        value = expiry_date.rstrip("Z")
+        # .NET emits 7 fractional digits; strptime only accepts 6
+        if "." in value:
+            head, fraction = value.split(".", 1)
+            value = f"{head}.{fraction[:6]}"
+            fmt = "%Y-%m-%dT%H:%M:%S.%f"
+        else:
+            fmt = "%Y-%m-%dT%H:%M:%S"
+        parsed = datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+    except ValueError:
+        logger.warning(f"Unrecognised token expiryDate: {expiry_date}")
+        return None
+
+
+def _request_token():
+    """Request a new token. Returns (token, expires_at) or (None, error)."""
     try:
         consumer_key = os.getenv(
             "PESAPAL_CONSUMER_KEY", "qkio1BGGYAXTu2JOfm7XSXNruoZsrqEW"
@@ -46,7 +388,7 @@ def get_access_token():
 
         if not consumer_key or not consumer_secret:
             logger.error("Pesapal credentials not configured")
-            return {"token": None, "error": "Credentials not configured"}
+            return None, "Credentials not configured"
 
         headers = {
             "Accept": "application/json",
@@ -58,25 +400,70 @@ def get_access_token():
             "consumer_secret": consumer_secret,
         }
 
-        response = requests.post(
-            TOKEN_ENDPOINT, json=data, headers=headers, timeout=30
+        response = client.post(
+            TOKEN_ENDPOINT,
+            "RequestToken",
+            idempotent=True,
+            json=data,
+            headers=headers,
         )
 
         if response.status_code == 200:
             result = response.json()
-            return {"token": result.get("token"), "error": None}
+            token = result.get("token")
+            if not token:
+                logger.error(f"Token response without token: {result}")
+                return None, result.get("error") or "No token returned"
+            expires_at = _parse_expiry(result.get("expiryDate"))
+            if expires_at is None:
+                expires_at = time.time() + TOKEN_DEFAULT_TTL
+            return token, expires_at
         else:
             logger.error(
                 f"Failed to get access token: {response.status_code} - {response.text}"
             )
-            return {"token": None, "error": f"HTTP {response.status_code}"}
+            return None, f"HTTP {response.status_code}"
 
     except requests.exceptions.Timeout:
         logger.error("Timeout while getting access token")
-        return {"token": None, "error": "Request timeout"}
+        return None, "Request timeout"
     except Exception as e:
         logger.error(f"Error getting access token: {e}")
-        return {"token": None, "error": str(e)}
+        return None, str(e)
+
+
+token_cache = TokenCache(
+    _request_token,
+    store=store_from_env(),
+    refresh_margin=int(os.getenv("PESAPAL_TOKEN_REFRESH_MARGIN", 60)),
+)
+
+
+def get_access_token():
+    """Get a Pesapal access token, reusing the cached one while valid."""
+    token, error = token_cache.get()
+    return {"token": token, "error": error}
+
+
+def _reauthenticate(rejected_token):
+    """
+    A token to use instead of one Pesapal rejected. The cache is only
+    cleared if it still holds the rejected token, so concurrent callers
+    do not throw away each other's fresh one.
+    """
+    token, _ = token_cache.get()
+    if token == rejected_token:
+        token_cache.invalidate()
+        token, _ = token_cache.get()
+    return token if token != rejected_token else None
+
+
+client.reauthenticate = _reauthenticate
+
+
+def get_token_cache_stats():
+    """Hit/miss/refresh counters for the token cache."""
+    return token_cache.stats()
 
 
 def get_notification_id(access_token, ipn_url):
@@ -90,8 +477,12 @@ def get_notification_id(access_token, ipn_url):
 
         data = {"url": ipn_url, "ipn_notification_type": "GET"}
 
-        response = requests.post(
-            REGISTER_IPN_ENDPOINT, json=data, headers=headers, timeout=30
+        response = client.post(
+            REGISTER_IPN_ENDPOINT,
+            "RegisterIPN",
+            idempotent=True,
+            json=data,
+            headers=headers,
         )
 
         if response.status_code == 200:
@@ -149,11 +540,11 @@ def get_merchant_order_url(order_details, access_token, base_url):
             },
         }
 
-        response = requests.post(
+        response = client.post(
             SUBMIT_ORDER_ENDPOINT,
+            "SubmitOrderRequest",
             json=order_request,
             headers=headers,
-            timeout=30,
         )
 
         if response.status_code == 200:
@@ -204,11 +595,11 @@ def get_transaction_status(order_tracking_id, access_token):
 
         params = {"orderTrackingId": order_tracking_id}
 
-        response = requests.get(
+        response = client.get(
             TRANSACTION_STATUS_ENDPOINT,
+            "GetTransactionStatus",
             params=params,
             headers=headers,
-            timeout=30,
         )
 
         if response.status_code == 200:
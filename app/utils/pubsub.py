@@ -0,0 +1,198 @@
+# File: app/utils/pubsub.py
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    Messages published on one or more channels, buffered for a single
+    listener.
+
+    If the listener falls behind, the oldest buffered message is dropped;
+    listeners only ever need the latest state.
+    """
+
+    def __init__(self, broker, channels, maxsize=100):
+        self.broker = broker
+        self.channels = tuple(channels)
+        self._queue = queue.Queue(maxsize=maxsize)
+
+    def put(self, message):
+        while True:
+            try:
+                self._queue.put_nowait(message)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next message, or None if nothing arrives within ``timeout``."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MemoryBroker:
+    """Publish/subscribe between threads of one process."""
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, *channels):
+        subscription = Subscription(self, channels)
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscriptions.setdefault(channel, set()).add(
+                    subscription
+                )
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                listeners = self._subscriptions.get(channel)
+                if listeners is not None:
+                    listeners.discard(subscription)
+                    if not listeners:
+                        del self._subscriptions[channel]
+
+    def publish(self, channel, message):
+        self._deliver(channel, message)
+
+    def publish_many(self, channels, message):
+        """Publish the same message on several channels."""
+        for channel in channels:
+            self._deliver(channel, message)
+
+    def _deliver(self, channel, message):
+        with self._lock:
+            listeners = list(self._subscriptions.get(channel, ()))
+        for subscription in listeners:
+            subscription.put(message)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": type(self).__name__,
+                "channels": len(self._subscriptions),
+                "subscribers": sum(
+                    len(s) for s in self._subscriptions.values()
+                ),
+            }
+
+
+class RedisBroker(MemoryBroker):
+    """
+    Publish/subscribe across worker processes through Redis.
+
+    Messages are published to Redis as JSON; one listener thread per
+    process pattern-subscribes to the prefix and hands them to local
+    subscribers. The client needs ``publish`` and ``pubsub``, as in
+    redis-py.
+    """
+
+    def __init__(self, client, prefix="clubsys:"):
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self._listener = None
+
+    def subscribe(self, *channels):
+        self._ensure_listener()
+        return super().subscribe(*channels)
+
+    def publish(self, channel, message):
+        try:
+            self.client.publish(self.prefix + channel, json.dumps(message))
+        except Exception as e:
+            # Local listeners still hear about it
+            logger.error(f"Redis publish to {channel} failed: {e}")
+            self._deliver(channel, message)
+
+    def publish_many(self, channels, message):
+        """Publish on several channels in one pipelined round trip."""
+        data = json.dumps(message)
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for channel in channels:
+                pipeline.publish(self.prefix + channel, data)
+            pipeline.execute()
+        except Exception as e:
+            logger.error(
+                f"Redis publish to {len(channels)} channels failed: {e}"
+            )
+            super().publish_many(channels, message)
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(
+                target=self._listen, name="pubsub-listener", daemon=True
+            )
+            self._listener.start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(self.prefix + "*")
+                for item in pubsub.listen():
+                    channel = item.get("channel")
+                    data = item.get("data")
+                    if isinstance(channel, bytes):
+                        channel = channel.decode("utf-8")
+                    if isinstance(data, bytes):
+                        data = data.decode("utf-8")
+                    if not channel or not isinstance(data, str):
+                        continue
+                    try:
+                        message = json.loads(data)
+                    except ValueError:
+                        continue
+                    self._deliver(channel[len(self.prefix) :], message)
+            except Exception as e:
+                logger.error(f"Redis pub/sub listener error: {e}")
+                time.sleep(1)
+
+
+def broker_from_env():
+    """Build the broker selected by PUBSUB_BACKEND (memory or redis)."""
+    backend = os.getenv("PUBSUB_BACKEND", "memory").lower()
+
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            logger.warning(
+                "redis package not installed, falling back to memory pub/sub"
+            )
+            return MemoryBroker()
+        url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        return RedisBroker(redis.Redis.from_url(url))
+
+    return MemoryBroker()
+
+
+broker = broker_from_env()
@@ -0,0 +1,194 @@
+# File: app/utils/token_cache.py
+
+import json
+import os
+import tempfile
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryTokenStore:
+    """Keep the token in this process only."""
+
+    def __init__(self):
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            return self._entry
+
+    def save(self, entry):
+        with self._lock:
+            self._entry = dict(entry)
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+
+
+class FileTokenStore:
+    """Share the token between workers on one host through a JSON file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, entry):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temp file and rename so readers never see half a token
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".token-")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as fh:
+                json.dump(entry, fh)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class RedisTokenStore:
+    """Share the token between workers through any Redis-compatible client.
+
+    The client only needs ``get``, ``set(name, value, ex=...)`` and
+    ``delete``, so a stand-in object works just as well as redis-py.
+    """
+
+    def __init__(self, client, key="pesapal:access_token"):
+        self.client = client
+        self.key = key
+
+    def load(self):
+        raw = self.client.get(self.key)
+        if not raw:
+            return None
+        if isinstance(raw, bytes):
+            raw = raw.decode("utf-8")
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return None
+
+    def save(self, entry):
+        ttl = max(int(entry["expires_at"] - time.time()), 1)
+        self.client.set(self.key, json.dumps(entry), ex=ttl)
+
+    def clear(self):
+        self.client.delete(self.key)
+
+
+def store_from_env():
+    """Build the token store selected by PESAPAL_TOKEN_BACKEND."""
+    backend = os.getenv("PESAPAL_TOKEN_BACKEND", "memory").lower()
+
+    if backend == "file":
+        path = os.getenv(
+            "PESAPAL_TOKEN_FILE",
+            os.path.join(tempfile.gettempdir(), "pesapal_token.json"),
+        )
+        return FileTokenStore(path)
+
+    if backend == "redis":
+        try:
+            import redis
+        except ImportError:
+            logger.warning(
+                "redis package not installed, falling back to memory token store"
+            )
+            return MemoryTokenStore()
+        url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        return RedisTokenStore(redis.Redis.from_url(url))
+
+    return MemoryTokenStore()
+
+
+class TokenCache:
+    """
+    Reuse an access token until shortly before it expires.
+
+    ``fetch`` is called with no arguments and must return a
+    ``(token, expires_at)`` tuple, where ``expires_at`` is a unix
+    timestamp, or ``(None, error)`` on failure. Only one thread per
+    process fetches at a time; the others wait and reuse its result.
+    """
+
+    def __init__(self, fetch, store=None, refresh_margin=60):
+        self.fetch = fetch
+        self.store = store or MemoryTokenStore()
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "refreshes": 0, "errors": 0}
+
+    def _count(self, name):
+        with self._stats_lock:
+            self._stats[name] += 1
+
+    def _fresh(self, entry):
+        return (
+            entry is not None
+            and entry.get("token")
+            and entry.get("expires_at", 0) - self.refresh_margin > time.time()
+        )
+
+    def _load(self):
+        try:
+            return self.store.load()
+        except Exception as e:
+            logger.warning(f"Token store read failed: {e}")
+            return None
+
+    def get(self):
+        """Return ``(token, error)``, fetching a new token if needed."""
+        entry = self._load()
+        if self._fresh(entry):
+            self._count("hits")
+            return entry["token"], None
+
+        self._count("misses")
+        with self._lock:
+            # Another thread (or worker) may have refreshed while we waited
+            entry = self._load()
+            if self._fresh(entry):
+                return entry["token"], None
+
+            token, expires_at = self.fetch()
+            if not token:
+                self._count("errors")
+                return None, expires_at
+
+            self._count("refreshes")
+            try:
+                self.store.save({"token": token, "expires_at": expires_at})
+            except Exception as e:
+                logger.warning(f"Token store write failed: {e}")
+            return token, None
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after the gateway rejects it."""
+        try:
+            self.store.clear()
+        except Exception as e:
+            logger.warning(f"Token store clear failed: {e}")
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(self._stats)
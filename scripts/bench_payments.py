@@ -0,0 +1,239 @@
+# File: scripts/bench_payments.py
+"""
+End-to-end payment load benchmark against the local fake Pesapal.
+
+Drives N concurrent checkouts through the real Flask app (in-process,
+via test clients): initiate -> wait for iframe URL -> callback -> IPN ->
+wait for Completed. Reports p50/p95/p99 latency per step and overall
+throughput.
+
+    python scripts/bench_payments.py --checkouts 200 --concurrency 20 \\
+        --latency 150
+
+By default a throwaway SQLite database is used; pass --database-url to
+benchmark against MySQL (tables are created if missing and test rows
+are left behind).
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_pesapal import FakePesapal, start_server  # noqa: E402
+
+BASE_URL = "http://localhost"
+STEPS = ["initiate", "order_ready", "callback", "ipn", "settled", "total"]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    # Nearest-rank percentile
+    rank = int(round(pct / 100 * len(ordered) + 0.5))
+    return ordered[min(max(rank - 1, 0), len(ordered) - 1)]
+
+
+def wait_for(client, payment_id, predicate, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        data = client.get(f"/payments/api/status/{payment_id}").get_json()
+        if predicate(data):
+            return data
+        time.sleep(0.02)
+    raise TimeoutError(f"Payment {payment_id} did not progress")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--checkouts", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument(
+        "--latency", type=float, default=100, help="Gateway latency in ms."
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=50, help="Random extra ms."
+    )
+    parser.add_argument("--fail-rate", type=float, default=0)
+    parser.add_argument(
+        "--gateway-url",
+        help="Use an already running Pesapal stand-in instead.",
+    )
+    parser.add_argument("--database-url")
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+
+    if args.gateway_url:
+        gateway_url = args.gateway_url
+    else:
+        gateway = FakePesapal(
+            latency=args.latency / 1000,
+            jitter=args.jitter / 1000,
+            fail_rate=args.fail_rate,
+        )
+        _, gateway_url = start_server(gateway)
+
+    # Configure before the app package reads its settings
+    os.environ["PESAPAL_BASE_URL"] = gateway_url
+    os.environ.setdefault("PAYMENT_IPN_DRAIN_INTERVAL", "5")
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    else:
+        db_path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}?timeout=30"
+
+    from app import create_app
+    from app.extensions import db
+    from app.models import Club, PesapalInterimPayment, Student, User
+    from app.utils.payments import register_ipn
+
+    app = create_app()
+    app.config["WTF_CSRF_ENABLED"] = False
+
+    run_id = int(time.time())
+    with app.app_context():
+        db.create_all()
+        club = Club(
+            name=f"Bench Club {run_id}",
+            category="Benchmark",
+            objectives="Load testing",
+            status="approved",
+        )
+        db.session.add(club)
+        users = [
+            User(
+                first_name="Bench",
+                last_name=str(i),
+                email=f"bench{run_id}_{i}@example.com",
+                gender="Other",
+                role="Student",
+                password_hash="!",
+            )
+            for i in range(args.checkouts)
+        ]
+        db.session.add_all(users)
+        db.session.flush()
+        db.session.add_all(Student(user_id=u.user_id) for u in users)
+        db.session.commit()
+        club_id = club.club_id
+        user_ids = [u.user_id for u in users]
+        # What `flask payments register-ipn` does at deploy time
+        register_ipn(BASE_URL)
+
+    timings = {step: [] for step in STEPS}
+    failures = []
+    lock = threading.Lock()
+
+    def checkout(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session["_user_id"] = str(user_id)
+            session["_fresh"] = True
+
+        marks = {}
+        start = time.perf_counter()
+
+        def mark(step, since):
+            marks[step] = time.perf_counter() - since
+            return time.perf_counter()
+
+        t = start
+        response = client.post(
+            "/payments/initiate",
+            json={
+                "purpose": "Membership",
+                "related_id": club_id,
+                "amount": 500,
+                "phone_number": "0700000000",
+            },
+        )
+        data = response.get_json()
+        if not data.get("success"):
+            raise RuntimeError(data.get("error"))
+        payment_id = data["payment_id"]
+        t = mark("initiate", t)
+
+        wait_for(
+            client,
+            payment_id,
+            lambda d: d["iframe_src"] or d["initiation"] == "FAILED",
+            args.timeout,
+        )
+        t = mark("order_ready", t)
+
+        with app.app_context():
+            tracking_id = (
+                PesapalInterimPayment.query.filter_by(paymentId=payment_id)
+                .one()
+                .orderTrackingId
+            )
+
+        client.get(f"/payments/pesapal/callback?OrderTrackingId={tracking_id}")
+        t = mark("callback", t)
+
+        client.get(
+            "/payments/pesapal/ipn?OrderNotificationType=IPNCHANGE"
+            f"&OrderTrackingId={tracking_id}"
+        )
+        t = mark("ipn", t)
+
+        wait_for(
+            client,
+            payment_id,
+            lambda d: d["status"] != "Pending",
+            args.timeout,
+        )
+        mark("settled", t)
+        marks["total"] = time.perf_counter() - start
+
+        with lock:
+            for step, elapsed in marks.items():
+                timings[step].append(elapsed * 1000)
+
+    def run(user_id):
+        try:
+            checkout(user_id)
+        except Exception as e:
+            with lock:
+                failures.append(str(e))
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(run, user_ids))
+    wall = time.perf_counter() - wall_start
+
+    completed = len(timings["total"])
+    print(
+        f"\n{args.checkouts} checkouts, concurrency {args.concurrency}, "
+        f"gateway {gateway_url}"
+    )
+    print(
+        f"{'step':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    for step in STEPS:
+        samples = timings[step]
+        print(
+            f"{step:<12}"
+            f"{percentile(samples, 50):>10.1f}"
+            f"{percentile(samples, 95):>10.1f}"
+            f"{percentile(samples, 99):>10.1f}"
+            f"{max(samples, default=0):>10.1f}"
+        )
+    print(f"\ncompleted   {completed}")
+    print(f"failed      {len(failures)}")
+    print(f"wall time   {wall:.2f} s")
+    print(f"throughput  {completed / wall:.1f} checkouts/s")
+    for error in sorted(set(failures))[:5]:
+        print(f"  error: {error}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+# File: scripts/fake_pesapal.py
+"""
+Local stand-in for the Pesapal v3 API, for load tests and offline work.
+
+Implements Auth/RequestToken, URLSetup/RegisterIPN,
+Transactions/SubmitOrderRequest and Transactions/GetTransactionStatus,
+with configurable latency and failure injection. With --ipn-delay set it
+also calls the registered IPN URL for each order, like Pesapal does.
+
+Run it, then start the app with PESAPAL_BASE_URL pointing at it:
+
+    python scripts/fake_pesapal.py --port 8090 --latency 150
+    PESAPAL_BASE_URL=http://127.0.0.1:8090/pesapalv3/api flask run
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import urlopen
+
+API_PREFIX = "/pesapalv3/api"
+
+
+class FakePesapal:
+    """Gateway state shared by all request handler threads."""
+
+    def __init__(
+        self,
+        latency=0.0,
+        jitter=0.0,
+        fail_rate=0.0,
+        final_status="Completed",
+        ipn_delay=None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.final_status = final_status
+        self.ipn_delay = ipn_delay
+        self.lock = threading.Lock()
+        self.ipn_urls = {}
+        self.orders = {}
+        self.calls = {}
+
+    def delay(self):
+        pause = self.latency + random.uniform(0, self.jitter)
+        if pause > 0:
+            time.sleep(pause)
+
+    def count(self, endpoint):
+        with self.lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def should_fail(self):
+        return self.fail_rate and random.random() < self.fail_rate
+
+    def request_token(self, body):
+        expiry = datetime.utcnow() + timedelta(minutes=5)
+        return {
+            "token": uuid.uuid4().hex,
+            "expiryDate": expiry.strftime("%Y-%m-%dT%H:%M:%S.%f0Z"),
+            "error": None,
+            "status": "200",
+            "message": "Request processed successfully",
+        }
+
+    def register_ipn(self, body):
+        ipn_id = str(uuid.uuid4())
+        with self.lock:
+            self.ipn_urls[ipn_id] = body.get("url")
+        return {
+            "url": body.get("url"),
+            "ipn_id": ipn_id,
+            "ipn_notification_type_description": "GET",
+            "status": "200",
+        }
+
+    def submit_order(self, body):
+        tracking_id = str(uuid.uuid4())
+        merchant_reference = body.get("id")
+        with self.lock:
+            self.orders[tracking_id] = {
+                "merchant_reference": merchant_reference,
+                "amount": body.get("amount"),
+                "currency": body.get("currency", "KES"),
+                "created": datetime.utcnow().isoformat(),
+            }
+            ipn_url = self.ipn_urls.get(body.get("notification_id"))
+
+        if self.ipn_delay is not None and ipn_url:
+            timer = threading.Timer(
+                self.ipn_delay,
+                self.send_ipn,
+                args=(ipn_url, tracking_id, merchant_reference),
+            )
+            timer.daemon = True
+            timer.start()
+
+        return {
+            "order_tracking_id": tracking_id,
+            "merchant_reference": merchant_reference,
+            "redirect_url": f"https://pay.example/iframe?OrderTrackingId={tracking_id}",
+            "error": None,
+            "status": "200",
+        }
+
+    def transaction_status(self, query):
+        tracking_id = query.get("orderTrackingId", [""])[0]
+        with self.lock:
+            order = self.orders.get(tracking_id)
+        if order is None:
+            return {"payment_status_description": "Invalid", "status": "500"}
+        return {
+            "payment_status_description": self.final_status,
+            "confirmation_code": f"FAKE{tracking_id[:8].upper()}",
+            "payment_method": "M-PESA",
+            "amount": order["amount"],
+            "currency": order["currency"],
+            "created_date": order["created"],
+            "merchant_reference": order["merchant_reference"],
+            "status": "200",
+        }
+
+    def send_ipn(self, ipn_url, tracking_id, merchant_reference):
+        query = urlencode(
+            {
+                "OrderTrackingId": tracking_id,
+                "OrderMerchantReference": merchant_reference,
+                "OrderNotificationType": "IPNCHANGE",
+            }
+        )
+        try:
+            urlopen(f"{ipn_url}?{query}", timeout=10).read()
+        except Exception as e:
+            print(f"IPN to {ipn_url} failed: {e}")
+
+
+def make_handler(gateway):
+    routes = {
+        ("POST", "/Auth/RequestToken"): gateway.request_token,
+        ("POST", "/URLSetup/RegisterIPN"): gateway.register_ipn,
+        ("POST", "/Transactions/SubmitOrderRequest"): gateway.submit_order,
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def send_json(self, payload, status=200):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def dispatch(self, method):
+            url = urlparse(self.path)
+            endpoint = url.path[len(API_PREFIX):]
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+
+            gateway.count(endpoint)
+            gateway.delay()
+            if gateway.should_fail():
+                return self.send_json({"error": "Injected failure"}, 500)
+
+            if method == "GET" and endpoint == (
+                "/Transactions/GetTransactionStatus"
+            ):
+                return self.send_json(
+                    gateway.transaction_status(parse_qs(url.query))
+                )
+
+            handler = routes.get((method, endpoint))
+            if handler is None:
+                return self.send_json({"error": "Not found"}, 404)
+            body = json.loads(raw or b"{}")
+            return self.send_json(handler(body))
+
+        def do_GET(self):
+            self.dispatch("GET")
+
+        def do_POST(self):
+            self.dispatch("POST")
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_server(gateway, host="127.0.0.1", port=0):
+    """Serve ``gateway`` on a daemon thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(gateway))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address
+    return server, f"http://{host}:{port}{API_PREFIX}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="Added latency in ms."
+    )
+    parser.add_argument(
+        "--jitter", type=float, default=0, help="Random extra latency in ms."
+    )
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0,
+        help="Fraction of calls answered with HTTP 500.",
+    )
+    parser.add_argument(
+        "--status",
+        default="Completed",
+        choices=["Completed", "Failed", "Invalid", "Reversed"],
+        help="Status reported by GetTransactionStatus.",
+    )
+    parser.add_argument(
+        "--ipn-delay",
+        type=float,
+        default=None,
+        help="Seconds after SubmitOrderRequest to call the IPN URL.",
+    )
+    args = parser.parse_args()
+
+    gateway = FakePesapal(
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        fail_rate=args.fail_rate,
+        final_status=args.status,
+        ipn_delay=args.ipn_delay,
+    )
+    server, base_url = start_server(gateway, args.host, args.port)
+    print(f"Fake Pesapal listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# File: tests/conftest.py
+
+import os
+
+import pytest
+
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+from app import create_app  # noqa: E402
+from app.extensions import db  # noqa: E402
+from app.models.club import Club  # noqa: E402
+from app.models.membership import Membership  # noqa: E402
+from app.models.student import Student  # noqa: E402
+from app.models.user import User  # noqa: E402
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def make_student(app):
+    """Create a student user, optionally an approved member of a club."""
+    created = []
+
+    def make(club=None):
+        n = len(created) + 1
+        user = User(
+            first_name=f"Student{n}",
+            last_name="Test",
+            email=f"student{n}@example.com",
+            gender="Other",
+            role="Student",
+            password_hash="x",
+        )
+        db.session.add(user)
+        db.session.flush()
+        student = Student(user_id=user.user_id)
+        db.session.add(student)
+        db.session.flush()
+        if club is not None:
+            db.session.add(
+                Membership(
+                    student_id=student.student_id,
+                    club_id=club.club_id,
+                    status="Approved",
+                )
+            )
+        db.session.commit()
+        created.append(user)
+        return user
+
+    return make
+
+
+@pytest.fixture
+def club(app):
+    club = Club(name="Chess", category="Games", objectives="Play chess")
+    db.session.add(club)
+    db.session.commit()
+    return club
@@ -0,0 +1,46 @@
+# File: tests/test_notification_audiences.py
+
+from app.extensions import db
+from app.models.membership import Membership
+from app.utils.notifications import (
+    get_user_notifications,
+    notify_audience,
+    unread_badge_count,
+)
+
+
+def titles(user):
+    items, _ = get_user_notifications(user)
+    return [notification.title for notification, _ in items]
+
+
+def test_new_user_does_not_inherit_past_broadcasts(make_student):
+    notify_audience("Welcome week", "m", "System")
+    notify_audience("Students only", "m", "System", role="Student")
+
+    student = make_student()
+
+    assert unread_badge_count(student) == 0
+    assert titles(student) == []
+
+    notify_audience("Exams", "m", "System", role="Student")
+    assert unread_badge_count(student) == 1
+    assert titles(student) == ["Exams"]
+
+
+def test_club_notices_start_when_the_student_joins(club, make_student):
+    student = make_student()
+    notify_audience("Before", "m", "Club", club_id=club.club_id)
+
+    db.session.add(
+        Membership(
+            student_id=student.student.student_id,
+            club_id=club.club_id,
+            status="Approved",
+        )
+    )
+    db.session.commit()
+    notify_audience("After", "m", "Club", club_id=club.club_id)
+
+    assert unread_badge_count(student) == 1
+    assert titles(student) == ["After"]
@@ -0,0 +1,61 @@
+# File: tests/test_notification_preferences.py
+
+from app.utils.notifications import (
+    get_user_notifications,
+    notify_audience,
+    set_preferences,
+    shows_in_feed,
+    unread_badge_count,
+)
+
+
+def titles(user):
+    items, _ = get_user_notifications(user)
+    return [notification.title for notification, _ in items]
+
+
+def test_type_off_hides_audience_notifications(club, make_student):
+    student = make_student(club)
+    notify_audience("Meetup", "m", "Event", club_id=club.club_id)
+    notify_audience("Maintenance", "m", "System")
+    assert unread_badge_count(student) == 2
+
+    set_preferences(student, {("Event", None): "Off"})
+
+    assert unread_badge_count(student) == 1
+    assert titles(student) == ["Maintenance"]
+
+
+def test_club_setting_beats_type_setting(club, make_student):
+    student = make_student(club)
+    notify_audience("Meetup", "m", "Event", club_id=club.club_id)
+
+    set_preferences(
+        student, {("Event", None): "Off", (None, club.club_id): "InApp"}
+    )
+    assert unread_badge_count(student) == 1
+
+    set_preferences(
+        student, {(None, club.club_id): "Off", ("Event", club.club_id): "InApp"}
+    )
+    assert unread_badge_count(student) == 1
+
+    set_preferences(student, {("Event", club.club_id): "Off"})
+    assert unread_badge_count(student) == 0
+
+
+def test_live_feed_skips_switched_off_audience_events():
+    preferences = [("Event", None, "Off")]
+    event = {
+        "event": "notification",
+        "notification": {"notification_type": "Event"},
+        "audience": "Club",
+        "club_id": 1,
+    }
+    system = {**event, "notification": {"notification_type": "System"}}
+
+    assert not shows_in_feed(preferences, event)
+    assert shows_in_feed(preferences, system)
+    # Direct notifications were filtered when they were sent
+    direct = {"event": "notification", "notification": event["notification"]}
+    assert shows_in_feed(preferences, direct)